@@ -0,0 +1,148 @@
+import time
+import threading
+from collections import OrderedDict, defaultdict
+
+from pydantic import BaseModel, Field
+
+from bitrix_qa_agent.retrieval import TOKEN_PATTERN, stem
+
+FILLER_WORDS = frozenset({
+    "подскажите", "пожалуйста", "здравствуйте", "добрый", "день", "привет", "скажите", "а", "и", "ну",
+})
+
+
+class CachedAnswer(BaseModel):
+    """Сохраненный ответ на вопрос по базе знаний"""
+
+    query: str = Field(description="Запрос, на который был получен ответ")
+    relevant_articles_ids: list[str] = Field(description="IDs релевантных статей")
+    answer: str = Field(description="Сгенерированный ответ до обработки в admin_node")
+    created_at: float = Field(description="Время сохранения (time.monotonic)")
+
+
+def normalize_query(query: str) -> tuple[str, ...]:
+    """Нормализовать запрос до последовательности основ слов без слов-паразитов. Порядок слов сохраняется:
+    "из Битрикса в Excel" и "из Excel в Битрикс" - разные запросы"""
+    return tuple(
+        stem(token) for token in TOKEN_PATTERN.findall(query.lower().replace("ё", "е"))
+        if token not in FILLER_WORDS
+    )
+
+
+def query_bigrams(key: tuple[str, ...]) -> frozenset[str]:
+    """Пары соседних основ запроса для поиска почти дубликатов с учетом порядка слов"""
+    if len(key) < 2:
+        return frozenset(key)
+    return frozenset(f"{first} {second}" for first, second in zip(key, key[1:]))
+
+
+class AnswerCache:
+    """LRU кеш ответов с TTL: точное совпадение, совпадение после нормализации и поиск почти дубликатов
+    по парам соседних слов"""
+
+    def __init__(self, max_size: int = 1000, ttl: float = 24 * 60 * 60, similarity_threshold: float = 0.85):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+        self.catalog_version: int | None = None
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[tuple[str, ...], CachedAnswer] = OrderedDict()
+        self._exact: dict[str, tuple[str, ...]] = {}
+        self._token_index: dict[str, set[tuple[str, ...]]] = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def get(self, query: str, catalog_version: int) -> CachedAnswer | None:
+        """Найти ответ на запрос. Кеш сбрасывается при изменении версии каталога статей"""
+        with self._lock:
+            self._check_catalog_version(catalog_version)
+            key = self._exact.get(query.strip())
+            if key is None:
+                key = normalize_query(query)
+                if key not in self._entries:
+                    key = self._find_similar(key)
+            entry = self._entries.get(key) if key is not None else None
+            if entry is not None and time.monotonic() - entry.created_at > self.ttl:
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def set(self, query: str, relevant_articles_ids: list[str], answer: str, catalog_version: int) -> None:
+        """Сохранить ответ на запрос"""
+        key = normalize_query(query)
+        if not key:
+            return
+        with self._lock:
+            self._check_catalog_version(catalog_version)
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = CachedAnswer(
+                query=query,
+                relevant_articles_ids=relevant_articles_ids,
+                answer=answer,
+                created_at=time.monotonic()
+            )
+            self._exact[query.strip()] = key
+            for bigram in query_bigrams(key):
+                self._token_index[bigram].add(key)
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate(self) -> None:
+        """Очистить кеш"""
+        with self._lock:
+            self._entries.clear()
+            self._exact.clear()
+            self._token_index.clear()
+
+    def _check_catalog_version(self, catalog_version: int) -> None:
+        if self.catalog_version != catalog_version:
+            self._entries.clear()
+            self._exact.clear()
+            self._token_index.clear()
+            self.catalog_version = catalog_version
+
+    def _find_similar(self, key: tuple[str, ...]) -> tuple[str, ...] | None:
+        """Найти сохраненный запрос с наибольшим коэффициентом Жаккара по парам соседних слов не ниже порога"""
+        bigrams = query_bigrams(key)
+        if not bigrams:
+            return None
+        candidates = set()
+        for bigram in bigrams:
+            candidates.update(self._token_index.get(bigram, ()))
+        best_key, best_similarity = None, self.similarity_threshold
+        for candidate in candidates:
+            candidate_bigrams = query_bigrams(candidate)
+            similarity = len(bigrams & candidate_bigrams) / len(bigrams | candidate_bigrams)
+            if similarity >= best_similarity:
+                best_key, best_similarity = candidate, similarity
+        return best_key
+
+    def _remove(self, key: tuple[str, ...]) -> None:
+        entry = self._entries.pop(key)
+        if self._exact.get(entry.query.strip()) == key:
+            del self._exact[entry.query.strip()]
+        for bigram in query_bigrams(key):
+            keys = self._token_index.get(bigram)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._token_index[bigram]
+
+
+_answer_cache: AnswerCache | None = None
+_answer_cache_lock = threading.Lock()
+
+
+def get_answer_cache() -> AnswerCache:
+    """Получить общий для процесса кеш ответов"""
+    global _answer_cache
+    with _answer_cache_lock:
+        if _answer_cache is None:
+            _answer_cache = AnswerCache()
+        return _answer_cache
@@ -0,0 +1,188 @@
+import json
+import time
+import asyncio
+import logging
+import threading
+from pathlib import Path
+
+from pydantic import BaseModel, Field
+
+from bitrix_qa_agent.utils import get_category, get_category_index, get_sections
+
+logger = logging.getLogger(__name__)
+
+
+class Article(BaseModel):
+    """Статья из документации с предизвлеченными разделами"""
+
+    id: str = Field(description="ID статьи")
+    title: str = Field(description="Тема статьи")
+    problem: str = Field(description="Проблема, решение которой описывается в статье")
+    article_filename: str = Field(description="Имя файла со статьей")
+    content: str = Field(description="Текст разделов РЕШЕНИЕ, ВАЖНО и ТЕХНИЧЕСКИЕ ДЕТАЛИ", default="")
+    sections: dict[str, str] = Field(description="Текст разделов по названию раздела", default_factory=dict)
+    category: str | None = Field(description="Категория статьи из заголовка Категория:", default=None)
+
+
+class ArticleCatalog:
+    """Каталог статей: метаданные и содержимое загружаются один раз и перечитываются при изменении mtime файлов"""
+
+    def __init__(self, metadata_path: Path, files_path: Path, reload_check_interval: float = 5.0):
+        self.metadata_path = Path(metadata_path)
+        self.files_path = Path(files_path)
+        self.reload_check_interval = reload_check_interval
+        self.version = 0
+        self._metadata: dict[str, dict] = {}
+        self._articles: dict[str, Article] = {}
+        self._categories: dict[str, list[str]] = {}
+        self._category_index = ""
+        self._mtimes: dict[Path, int] = {}
+        self._last_check = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def metadata(self) -> dict[str, dict]:
+        """Метаданные статей в формате articles_metadata.json"""
+        self._ensure_loaded()
+        return self._metadata
+
+    @property
+    def articles(self) -> dict[str, Article]:
+        """Статьи по ID в порядке метаданных"""
+        self._ensure_loaded()
+        return self._articles
+
+    @property
+    def categories(self) -> dict[str, list[str]]:
+        """IDs статей по категориям. Категории упорядочены по названию"""
+        self._ensure_loaded()
+        return self._categories
+
+    @property
+    def category_index(self) -> str:
+        """Компактный список категорий для выбора категорий моделью, ID категории - номер в categories"""
+        self._ensure_loaded()
+        return self._category_index
+
+    def get(self, article_id: str) -> Article | None:
+        """Получить статью по ID"""
+        return self.articles.get(str(article_id))
+
+    def get_many(self, article_ids: list[str]) -> list[Article]:
+        """Получить статьи по списку ID, неизвестные ID пропускаются"""
+        articles = self.articles
+        return [articles[_id] for _id in map(str, article_ids) if _id in articles]
+
+    def refresh(self, force: bool = False) -> bool:
+        """Перечитать каталог, если изменились файлы. Возвращает True, если каталог был перезагружен"""
+        with self._lock:
+            self._last_check = time.monotonic()
+            mtimes = self._collect_mtimes()
+            if not force and self.version and mtimes == self._mtimes:
+                return False
+            self._load(mtimes)
+            return True
+
+    async def arefresh(self) -> "ArticleCatalog":
+        """Проверить изменения файлов не чаще, чем раз в reload_check_interval, не блокируя event loop"""
+        if not self.version or time.monotonic() - self._last_check >= self.reload_check_interval:
+            await asyncio.to_thread(self.refresh)
+        return self
+
+    def _ensure_loaded(self) -> None:
+        if not self.version:
+            self.refresh()
+
+    def _article_path(self, metadata: dict) -> Path:
+        return self.files_path / metadata["article_filename"]
+
+    @staticmethod
+    def _mtime(path: Path) -> int | None:
+        try:
+            return path.stat().st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _collect_mtimes(self) -> dict[Path, int | None]:
+        mtimes = {self.metadata_path: self._mtime(self.metadata_path)}
+        for metadata in self._metadata.values():
+            path = self._article_path(metadata)
+            mtimes[path] = self._mtime(path)
+        return mtimes
+
+    def _load(self, mtimes: dict[Path, int | None]) -> None:
+        with open(self.metadata_path, "r", encoding="utf-8") as f:
+            metadata = json.load(f)
+
+        articles = {}
+        missing_files = []
+        new_mtimes = {self.metadata_path: mtimes.get(self.metadata_path)}
+        for _id, article_metadata in metadata.items():
+            path = self._article_path(article_metadata)
+            mtime = self._mtime(path)
+            new_mtimes[path] = mtime
+            if mtime is None:
+                missing_files.append(article_metadata["article_filename"])
+            previous = self._articles.get(_id)
+            if (
+                previous is not None
+                and previous.article_filename == article_metadata["article_filename"]
+                and self._mtimes.get(path) == mtime
+            ):
+                sections, category = previous.sections, previous.category
+            else:
+                sections, category = self._read_article(path)
+            articles[_id] = Article(
+                id=_id,
+                title=article_metadata["title"],
+                problem=article_metadata["problem"],
+                article_filename=article_metadata["article_filename"],
+                content="\n".join(sections.values()),
+                sections=sections,
+                category=category
+            )
+
+        categories = {}
+        for _id, article in articles.items():
+            if article.category:
+                categories.setdefault(article.category, []).append(_id)
+        categories = dict(sorted(categories.items()))
+
+        self._metadata = metadata
+        self._articles = articles
+        self._categories = categories
+        self._category_index = get_category_index({
+            category: [articles[_id].title for _id in ids] for category, ids in categories.items()
+        })
+        self._mtimes = new_mtimes
+        self.version += 1
+        if missing_files:
+            logger.warning("Не найдены файлы для %s статей из %s", len(missing_files), self.files_path)
+        logger.info(
+            "Каталог статей загружен: %s статей в %s категориях, версия %s",
+            len(articles), len(categories), self.version
+        )
+
+    @staticmethod
+    def _read_article(path: Path) -> tuple[dict[str, str], str | None]:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                article_content = f.read()
+        except FileNotFoundError:
+            return {}, None
+        return get_sections(article_content=article_content), get_category(article_content=article_content)
+
+
+_catalogs: dict[tuple[Path, Path], ArticleCatalog] = {}
+_catalogs_lock = threading.Lock()
+
+
+def get_article_catalog(metadata_path: Path, files_path: Path) -> ArticleCatalog:
+    """Получить общий для процесса каталог статей для заданных путей"""
+    key = (Path(metadata_path).resolve(), Path(files_path).resolve())
+    with _catalogs_lock:
+        catalog = _catalogs.get(key)
+        if catalog is None:
+            catalog = ArticleCatalog(metadata_path=key[0], files_path=key[1])
+            _catalogs[key] = catalog
+        return catalog
@@ -1 +1 @@
-from .chains import choose_article_chain, generate_answer_chain, admin_answer_chain, classify_message_chain, prepare_query_chain
\ No newline at end of file
+from .chains import choose_article_chain, choose_category_chain, generate_answer_chain, admin_answer_chain, classify_message_chain, prepare_query_chain
\ No newline at end of file
@@ -2,16 +2,32 @@ from langchain_core.runnables import Runnable
 from langchain_core.language_models import BaseChatModel
 from langchain_core.output_parsers import StrOutputParser
 
+from bitrix_qa_agent.chains.memo import MemoStore, memoize_structured_chain
 from bitrix_qa_agent.chains.prompts import (
-    choose_article_prompt, ArticleRelevantIDS, generate_answer_prompt,
+    choose_article_prompt, ArticleRelevantIDS, choose_category_prompt, CategoryRelevantIDS, generate_answer_prompt,
     message_type_classification_prompt, MessageTypeClassification, admin_prompt, prepare_query_prompt,
-    support_session_end_prompt
+    support_session_end_prompt, history_summary_prompt
 )
 
 
-def choose_article_chain(model: BaseChatModel) -> Runnable:
-    """Цепочка для выбора релевантных статей"""
-    return choose_article_prompt | model.with_structured_output(ArticleRelevantIDS)
+def choose_article_chain(model: BaseChatModel, memo_store: MemoStore | None = None) -> Runnable:
+    """Цепочка для выбора релевантных статей. С memo_store результаты сохраняются между запросами"""
+    chain = choose_article_prompt | model.with_structured_output(ArticleRelevantIDS)
+    if memo_store is not None:
+        chain = memoize_structured_chain(
+            chain=chain, store=memo_store, model=model, prompt=choose_article_prompt, output_schema=ArticleRelevantIDS
+        )
+    return chain
+
+
+def choose_category_chain(model: BaseChatModel, memo_store: MemoStore | None = None) -> Runnable:
+    """Цепочка для выбора категорий статей. С memo_store результаты сохраняются между запросами"""
+    chain = choose_category_prompt | model.with_structured_output(CategoryRelevantIDS)
+    if memo_store is not None:
+        chain = memoize_structured_chain(
+            chain=chain, store=memo_store, model=model, prompt=choose_category_prompt, output_schema=CategoryRelevantIDS
+        )
+    return chain
 
 
 def generate_answer_chain(model: BaseChatModel) -> Runnable:
@@ -37,3 +53,8 @@ def prepare_query_chain(model: BaseChatModel) -> Runnable:
 def is_support_session_end_chain(model: BaseChatModel) -> Runnable:
     """Цепочка для определения окончания сессии поддержки"""
     return support_session_end_prompt | model | StrOutputParser()
+
+
+def summarize_history_chain(model: BaseChatModel) -> Runnable:
+    """Цепочка для дополнения краткого содержания диалога новыми сообщениями"""
+    return history_summary_prompt | model | StrOutputParser()
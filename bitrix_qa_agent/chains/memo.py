@@ -0,0 +1,154 @@
+import os
+import json
+import time
+import sqlite3
+import asyncio
+import hashlib
+import threading
+from abc import ABC, abstractmethod
+from pathlib import Path
+
+from pydantic import BaseModel
+from langchain_core.runnables import Runnable, RunnableLambda
+from langchain_core.prompts import BasePromptTemplate
+from langchain_core.language_models import BaseChatModel
+
+
+class MemoStore(ABC):
+    """Хранилище результатов LLM цепочек"""
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @abstractmethod
+    def get(self, key: str) -> str | None:
+        """Получить сохраненное значение"""
+
+    @abstractmethod
+    def set(self, key: str, value: str) -> None:
+        """Сохранить значение"""
+
+    async def aget(self, key: str) -> str | None:
+        return await asyncio.to_thread(self.get, key)
+
+    async def aset(self, key: str, value: str) -> None:
+        await asyncio.to_thread(self.set, key, value)
+
+    def stats(self) -> dict[str, int]:
+        """Метрики попаданий в хранилище"""
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+
+class SQLiteMemoStore(MemoStore):
+    """Хранилище в файле SQLite, переживает перезапуски процесса. Вытесняются давно не использованные записи"""
+
+    eviction_check_interval = 100
+
+    def __init__(self, path: Path, max_entries: int = 100_000):
+        super().__init__()
+        self.path = Path(path)
+        self.max_entries = max_entries
+        self._writes = 0
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS memo (key TEXT PRIMARY KEY, value TEXT NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS memo_accessed_at ON memo (accessed_at)")
+
+    def get(self, key: str) -> str | None:
+        with self._lock:
+            row = self._connection.execute(
+                "UPDATE memo SET accessed_at = ? WHERE key = ? RETURNING value", (time.time(), key)
+            ).fetchone()
+        return row[0] if row else None
+
+    def set(self, key: str, value: str) -> None:
+        with self._lock:
+            self._connection.execute(
+                "INSERT INTO memo (key, value, accessed_at) VALUES (?, ?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET value = excluded.value, accessed_at = excluded.accessed_at",
+                (key, value, time.time())
+            )
+            self._writes += 1
+            if self._writes % self.eviction_check_interval:
+                return
+            count = self._connection.execute("SELECT count(*) FROM memo").fetchone()[0]
+            if count > self.max_entries:
+                # удаляем с запасом, чтобы не вытеснять на каждой записи
+                excess = count - self.max_entries + self.max_entries // 10
+                self._connection.execute(
+                    "DELETE FROM memo WHERE key IN (SELECT key FROM memo ORDER BY accessed_at LIMIT ?)", (excess,)
+                )
+                self.evictions += excess
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+
+def model_name(model: BaseChatModel) -> str:
+    """Название модели для ключа кеша"""
+    return getattr(model, "model_name", None) or getattr(model, "model", None) or type(model).__name__
+
+
+def memoize_structured_chain(
+    chain: Runnable,
+    store: MemoStore,
+    model: BaseChatModel,
+    prompt: BasePromptTemplate,
+    output_schema: type[BaseModel]
+) -> Runnable:
+    """Обернуть цепочку со структурированным выводом в кеш по хешу модели, промпта и входных данных"""
+    namespace = hashlib.sha256(f"{model_name(model)}\n{prompt.pretty_repr()}".encode("utf-8")).hexdigest()
+
+    def get_key(_input: dict) -> str:
+        payload = json.dumps(_input, ensure_ascii=False, sort_keys=True, default=str)
+        return hashlib.sha256(f"{namespace}\n{payload}".encode("utf-8")).hexdigest()
+
+    async def ainvoke(_input: dict, config=None) -> BaseModel:
+        key = get_key(_input)
+        value = await store.aget(key)
+        if value is not None:
+            store.hits += 1
+            return output_schema.model_validate_json(value)
+        store.misses += 1
+        result = await chain.ainvoke(_input, config=config)
+        if result is not None:
+            await store.aset(key, result.model_dump_json())
+        return result
+
+    def invoke(_input: dict, config=None) -> BaseModel:
+        key = get_key(_input)
+        value = store.get(key)
+        if value is not None:
+            store.hits += 1
+            return output_schema.model_validate_json(value)
+        store.misses += 1
+        result = chain.invoke(_input, config=config)
+        if result is not None:
+            store.set(key, result.model_dump_json())
+        return result
+
+    return RunnableLambda(invoke, afunc=ainvoke, name=chain.get_name())
+
+
+DEFAULT_MEMO_PATH = Path(__file__).parent.parent / "qa_data" / "cache" / "llm_memo.sqlite3"
+
+_memo_stores: dict[Path, SQLiteMemoStore] = {}
+_memo_stores_lock = threading.Lock()
+
+
+def get_memo_store(path: Path | None = None) -> SQLiteMemoStore:
+    """Получить общее для процесса хранилище. Путь по умолчанию задается переменной окружения LLM_MEMO_PATH"""
+    path = Path(path or os.getenv("LLM_MEMO_PATH") or DEFAULT_MEMO_PATH).resolve()
+    with _memo_stores_lock:
+        store = _memo_stores.get(path)
+        if store is None:
+            store = SQLiteMemoStore(path=path, max_entries=int(os.getenv("LLM_MEMO_MAX_ENTRIES", 100_000)))
+            _memo_stores[path] = store
+        return store
@@ -32,6 +32,35 @@ class ArticleRelevantIDS(BaseModel):
         description="ID статей из документации, которые содержат релевантную информацию по вопросу. Если НИ ОДНА из статей не подходит - верни null.")
 
 
+choose_categories_system = """## Ты - специалист технической поддержки, который может ответить на вопрос пользователя по его проблеме с CRM-системой Битрикс24.
+## Тебе предоставлен список категорий статей из документации по этой CRM-системе:
+1. ID категории
+2. Категория - название категории и число статей в ней
+3. Примеры тем - названия нескольких статей категории
+
+## Твоя задача
+Внимательно изучи вопрос пользователя и скажи, в каких категориях стоит искать статьи для ответа на него.
+Выбери не больше {max_categories} категорий, самые подходящие - первыми.
+
+## Формат ответа
+В ответе верни ID категорий, в формате списке.
+Если ни одна категория не подходит или ты не уверен - верни null.
+"""
+
+choose_categories_user = """Категории статей из документации:
+{categories}
+
+Вопрос пользователя: {query}
+"""
+
+choose_category_prompt = ChatPromptTemplate.from_messages([("system", choose_categories_system), ("user", choose_categories_user)])
+
+class CategoryRelevantIDS(BaseModel):
+    """ID релевантных категорий"""
+    relevant_categories_ids: list[int] | None = Field(
+        description="ID категорий, в статьях которых стоит искать ответ на вопрос. Если НИ ОДНА категория не подходит - верни null.")
+
+
 generate_answer_system = """Ты - специалист технической поддержки по CRM-системе Битрикс24.
 Тебе даны:
 - Текст документации
@@ -211,4 +240,28 @@ support_session_end_user = """Диалог с сессией поддержки:
 В ответе верни 1, если сессия завершена, 0 - если не завершена. Выведи ТОЛЬКО 1 или 0, не выводи никакие рассуждения и прочий лишний текст.
 """
 
-support_session_end_prompt = ChatPromptTemplate.from_messages([("system", support_session_end_system), ("user", support_session_end_user)])
\ No newline at end of file
+support_session_end_prompt = ChatPromptTemplate.from_messages([("system", support_session_end_system), ("user", support_session_end_user)])
+
+history_summary_system = """Ты — помощник, который ведет краткое содержание диалога клиента со службой технической поддержки CRM-системы Битрикс24.
+Тебе даны текущее краткое содержание диалога (может быть пустым) и новые сообщения, которые в него еще не вошли.
+
+## Задача
+Дополни краткое содержание новыми сообщениями. Сохрани:
+- вопросы и проблемы клиента;
+- сведения о его системе и настройках;
+- что уже предложено клиенту и помогло ли это;
+- договоренности и нерешенные вопросы.
+
+Не пересказывай приветствия и вежливые формулы. Объем — не более 150 слов. Выведи только краткое содержание, без лишнего текста.
+"""
+
+history_summary_user = """Текущее краткое содержание:
+{summary}
+
+Новые сообщения:
+{messages}
+
+Обновленное краткое содержание:
+"""
+
+history_summary_prompt = ChatPromptTemplate.from_messages([("system", history_summary_system), ("user", history_summary_user)])
@@ -1,10 +1,18 @@
 import os
+from typing import Literal
 from pathlib import Path
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
 from langchain.chat_models import init_chat_model
 from langchain_core.language_models import BaseChatModel
 
+from bitrix_qa_agent.catalog import ArticleCatalog, get_article_catalog
+from bitrix_qa_agent.retrieval import ArticleRetriever, get_article_retriever
+from bitrix_qa_agent.answer_cache import AnswerCache, get_answer_cache
+from bitrix_qa_agent.chains.memo import MemoStore, get_memo_store
+from bitrix_qa_agent.selection import SelectionPolicy
+from bitrix_qa_agent.model_router import ModelCascade, ModelRouter, default_model_cascades
+
 
 class ChatModel(BaseModel):
     """LLM модель с возьможностью чата"""
@@ -18,32 +26,49 @@ class ChatModel(BaseModel):
         return init_chat_model(model_provider=self.provider, model=self.model, **self.kwargs)
 
 
+LIGHT_MODEL_NAME = "google/gemini-2.5-flash-lite"
+PRO_MODEL_NAME = "google/gemini-2.5-flash"
+
+
+def openrouter_chat_model(model: str, **kwargs) -> ChatModel:
+    """Модель OpenRouter через OpenAI-совместимый API"""
+    return ChatModel(
+        provider="openai",
+        model=model,
+        kwargs={
+            "api_key": os.getenv("OPENROUTER_API_KEY"),
+            "base_url":"https://openrouter.ai/api/v1",
+            "temperature": 0,
+            **kwargs
+        }
+    )
+
+
 class BitrixQAContext(BaseModel):
     """Контекст графа"""
 
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
     light_model: BaseChatModel = Field(
         description="LLM",
-        default_factory=lambda: ChatModel(
-            provider="openai",
-            model="google/gemini-2.5-flash-lite",
-            kwargs={
-                "api_key": os.getenv("OPENROUTER_API_KEY"),
-                "base_url":"https://openrouter.ai/api/v1",
-                "temperature": 0
-            }
-        ).chat_model)
+        default_factory=lambda: openrouter_chat_model(LIGHT_MODEL_NAME).chat_model)
 
     pro_model: BaseChatModel = Field(
         description="LLM",
-        default_factory=lambda: ChatModel(
-            provider="openai",
-            model="google/gemini-2.5-flash",
-            kwargs={
-                "api_key": os.getenv("OPENROUTER_API_KEY"),
-                "base_url":"https://openrouter.ai/api/v1",
-                "temperature": 0
-            }
-        ).chat_model)
+        default_factory=lambda: openrouter_chat_model(PRO_MODEL_NAME).chat_model)
+
+    model_cascades: dict[str, ModelCascade] = Field(
+        description="Каскады моделей по узлам: admin, session_end, classify",
+        default_factory=default_model_cascades
+    )
+    model_router: ModelRouter = Field(
+        description="Выбор между light_model и pro_model по каскадам узлов",
+        default_factory=lambda data: ModelRouter(
+            light_model=data["light_model"],
+            pro_model=data["pro_model"],
+            cascades=data["model_cascades"]
+        )
+    )
 
     articles_metadata_path: Path = Field(
         description="Путь до метаданных статей из документации",
@@ -54,3 +79,62 @@ class BitrixQAContext(BaseModel):
         default_factory=lambda: Path(__file__).parent / "qa_data" / "opensource_articles" / "source_content"
     )
     articles_batch_size: int = Field(description="Размер батча для количества статей в одном промпте", default=10)
+    selection_policy: SelectionPolicy = Field(
+        description="Политика раннего завершения выбора статей по батчам",
+        default_factory=SelectionPolicy
+    )
+    article_catalog: ArticleCatalog = Field(
+        description="Каталог статей, общий для всех запросов процесса",
+        default_factory=lambda data: get_article_catalog(
+            metadata_path=data["articles_metadata_path"],
+            files_path=data["articles_files_path"]
+        )
+    )
+    retrieval_top_k: int | None = Field(
+        description="Сколько статей-кандидатов локального поиска отправлять в LLM. None - отправлять все статьи",
+        default=30
+    )
+    retrieval_use_vectors: bool = Field(
+        description="Объединять BM25 с локальным векторным индексом",
+        default=True
+    )
+    article_retriever: ArticleRetriever = Field(
+        description="Локальный поиск статей-кандидатов, общий для всех запросов процесса",
+        default_factory=lambda data: get_article_retriever(
+            catalog=data["article_catalog"],
+            use_vectors=data["retrieval_use_vectors"]
+        )
+    )
+    category_routing: Literal["off", "llm", "local"] = Field(
+        description=(
+            "Двухуровневый выбор статей: сначала категории, затем статьи только из них. "
+            "off - без выбора категорий, llm - категории выбирает модель по списку категорий, "
+            "local - категории статей-кандидатов локального поиска"
+        ),
+        default="off"
+    )
+    category_routing_max_categories: int = Field(description="Максимальное число выбранных категорий", default=3)
+    category_routing_top_k: int = Field(
+        description="Сколько статей локального поиска учитывать при выборе категорий в режиме local",
+        default=20
+    )
+    answer_cache: AnswerCache | None = Field(
+        description="Кеш ответов на вопросы по базе знаний, общий для всех запросов процесса. None - кеш отключен",
+        default_factory=get_answer_cache
+    )
+    memo_store: MemoStore | None = Field(
+        description="Персистентное хранилище структурированных ответов LLM для детерминированных цепочек. None - отключено",
+        default_factory=get_memo_store
+    )
+    context_token_budget: int | None = Field(
+        description="Максимальный размер контекста статей для ответа в токенах. None - без ограничения",
+        default=6000
+    )
+    tokenizer_encoding: str = Field(description="Словарь tiktoken для подсчета токенов", default="o200k_base")
+    speculative_execution: Literal["off", "query", "selection"] = Field(
+        description=(
+            "Спекулятивное выполнение параллельно с классификацией сообщения: "
+            "off - последовательно, query - переформулирование запроса, selection - также выбор статей"
+        ),
+        default="off"
+    )
@@ -0,0 +1,106 @@
+import re
+import asyncio
+import logging
+from functools import lru_cache
+
+import tiktoken
+
+from bitrix_qa_agent.catalog import Article
+
+logger = logging.getLogger(__name__)
+
+# ценность раздела статьи относительно раздела РЕШЕНИЕ
+SECTION_WEIGHTS = {"РЕШЕНИЕ": 1.0, "ВАЖНО": 0.6, "ТЕХНИЧЕСКИЕ ДЕТАЛИ": 0.35}
+# оценка числа символов на токен, если словарь токенизатора недоступен
+CHARS_PER_TOKEN = 3
+# повторы короче этого числа символов не выбрасываются: короткие строки шагов инструкций ("Нажмите «Сохранить»")
+# встречаются во многих статьях, и без них инструкция теряет шаги
+MIN_DEDUP_LINE_CHARS = 80
+
+
+@lru_cache(maxsize=None)
+def get_encoding(encoding_name: str) -> tiktoken.Encoding | None:
+    """Токенизатор tiktoken. None, если словарь не удалось загрузить"""
+    try:
+        return tiktoken.get_encoding(encoding_name)
+    except Exception:
+        logger.warning("Не удалось загрузить токенизатор %s, число токенов оценивается по длине текста", encoding_name)
+        return None
+
+
+async def aget_encoding(encoding_name: str) -> tiktoken.Encoding | None:
+    """Загрузить токенизатор в отдельном потоке: первая загрузка может скачивать словарь и не должна
+    блокировать event loop"""
+    return await asyncio.to_thread(get_encoding, encoding_name)
+
+
+def count_tokens(text: str, encoding_name: str = "o200k_base") -> int:
+    """Число токенов в тексте"""
+    encoding = get_encoding(encoding_name)
+    if encoding is None:
+        return -(-len(text) // CHARS_PER_TOKEN)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def _normalize_line(line: str) -> str:
+    return re.sub(r"\W+", " ", line.lower().replace("ё", "е")).strip()
+
+
+def pack_context(
+    articles: list[Article],
+    token_budget: int | None,
+    encoding_name: str = "o200k_base",
+    separator: str = "\n\n"
+) -> str:
+    """Собрать контекст из разделов статей, упорядоченных по релевантности, в пределах token_budget токенов.
+
+    Ценность раздела - вес раздела, деленный на позицию статьи. Разделы добавляются по убыванию ценности.
+    Раздел, повторяющий уже добавленный, пропускается целиком, из остальных выбрасываются только повторы
+    длинных строк. Разделы, не помещающиеся в бюджет, пропускаются. В контексте разделы идут по статьям
+    в порядке релевантности.
+    """
+    candidates = []
+    for rank, article in enumerate(articles):
+        sections = article.sections or ({"РЕШЕНИЕ": article.content} if article.content else {})
+        for order, (section, text) in enumerate(sections.items()):
+            value = SECTION_WEIGHTS.get(section, min(SECTION_WEIGHTS.values())) / (rank + 1)
+            candidates.append((value, rank, order, text))
+    candidates.sort(key=lambda candidate: (-candidate[0], candidate[1], candidate[2]))
+
+    separator_tokens = count_tokens(separator, encoding_name)
+    seen_sections: set[str] = set()
+    seen_lines: set[str] = set()
+    selected: dict[tuple[int, int], str] = {}
+    used_tokens = 0
+    for _, rank, order, text in candidates:
+        section_key = _normalize_line(text)
+        if not section_key or section_key in seen_sections:
+            continue
+        lines = []
+        for line in text.split("\n"):
+            key = _normalize_line(line)
+            if len(key) >= MIN_DEDUP_LINE_CHARS and key in seen_lines:
+                continue
+            lines.append(line)
+        if not any(_normalize_line(line) for line in lines):
+            continue
+        text = "\n".join(lines)
+        tokens = count_tokens(text, encoding_name) + (separator_tokens if selected else 0)
+        if token_budget is not None and used_tokens + tokens > token_budget:
+            if selected:
+                continue
+            # самый ценный раздел не помещается целиком: берем его начало
+            text = _truncate(text, token_budget, encoding_name)
+            tokens = count_tokens(text, encoding_name)
+        seen_sections.add(section_key)
+        seen_lines.update(key for key in map(_normalize_line, lines) if len(key) >= MIN_DEDUP_LINE_CHARS)
+        selected[(rank, order)] = text
+        used_tokens += tokens
+    return separator.join(selected[key] for key in sorted(selected))
+
+
+def _truncate(text: str, token_budget: int, encoding_name: str) -> str:
+    encoding = get_encoding(encoding_name)
+    if encoding is None:
+        return text[:token_budget * CHARS_PER_TOKEN]
+    return encoding.decode(encoding.encode(text, disallowed_special=())[:token_budget])
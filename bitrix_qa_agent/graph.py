@@ -1,23 +1,44 @@
+from functools import cache
+
 from langgraph.graph import StateGraph
 from langgraph.constants import START, END
 
 from bitrix_qa_agent.state import BitrixQAState
 from bitrix_qa_agent.context import BitrixQAContext
 from bitrix_qa_agent.nodes import (
-    prepare_search_query, get_relevant_articles_ids, form_context, generate_answer,
-    classify_message_type, admin_node
+    prepare_search_query, lookup_cached_answer, shortlist_articles, route_categories, get_relevant_articles_ids,
+    form_context, generate_answer, save_answer_to_cache, classify_message_type, admin_node, classify_with_speculation
 )
-from bitrix_qa_agent.routing_functions import message_type_routing
+from bitrix_qa_agent.routing_functions import message_type_routing, answer_cache_routing, speculative_routing
 
-builder = StateGraph(BitrixQAState, context_schema=BitrixQAContext)
 
+def add_answer_nodes(graph_builder: StateGraph) -> None:
+    """Добавить в граф выбор статей, генерацию ответа по базе знаний и ответ в режиме чата"""
+    graph_builder.add_node(admin_node.__graphname__, admin_node)
+    graph_builder.add_node(shortlist_articles.__graphname__, shortlist_articles)
+    graph_builder.add_node(route_categories.__graphname__, route_categories)
+    graph_builder.add_node(get_relevant_articles_ids.__graphname__, get_relevant_articles_ids)
+    graph_builder.add_node(form_context.__graphname__, form_context)
+    graph_builder.add_node(generate_answer.__graphname__, generate_answer)
+    graph_builder.add_node(save_answer_to_cache.__graphname__, save_answer_to_cache)
+
+    graph_builder.add_edge(shortlist_articles.__graphname__, route_categories.__graphname__)
+    graph_builder.add_edge(route_categories.__graphname__, get_relevant_articles_ids.__graphname__)
+    graph_builder.add_edge(get_relevant_articles_ids.__graphname__, form_context.__graphname__)
+    graph_builder.add_edge(form_context.__graphname__, generate_answer.__graphname__)
+    graph_builder.add_edge(generate_answer.__graphname__, save_answer_to_cache.__graphname__)
+    graph_builder.add_edge(save_answer_to_cache.__graphname__, admin_node.__graphname__)
+
+    # часть графа для получения ответа на сообщение
+    graph_builder.add_edge(admin_node.__graphname__, END)
+
+
+builder = StateGraph(BitrixQAState, context_schema=BitrixQAContext)
 
 builder.add_node(prepare_search_query.__graphname__, prepare_search_query)
 builder.add_node(classify_message_type.__graphname__, classify_message_type)
-builder.add_node(admin_node.__graphname__, admin_node)
-builder.add_node(get_relevant_articles_ids.__graphname__, get_relevant_articles_ids)
-builder.add_node(form_context.__graphname__, form_context)
-builder.add_node(generate_answer.__graphname__, generate_answer)
+builder.add_node(lookup_cached_answer.__graphname__, lookup_cached_answer)
+add_answer_nodes(builder)
 
 builder.add_edge(START, classify_message_type.__graphname__)
 builder.add_conditional_edges(
@@ -30,14 +51,64 @@ builder.add_conditional_edges(
     }
 )
 # часть графа с qa
-builder.add_edge(prepare_search_query.__graphname__, get_relevant_articles_ids.__graphname__)
-builder.add_edge(get_relevant_articles_ids.__graphname__, form_context.__graphname__)
-builder.add_edge(form_context.__graphname__, generate_answer.__graphname__)
-builder.add_edge(generate_answer.__graphname__, admin_node.__graphname__)
+builder.add_edge(prepare_search_query.__graphname__, lookup_cached_answer.__graphname__)
+builder.add_conditional_edges(
+    lookup_cached_answer.__graphname__,
+    answer_cache_routing,
+    {
+        "hit": admin_node.__graphname__,
+        "miss": shortlist_articles.__graphname__
+    }
+)
 
-# часть графа для получения ответа на сообщение
-builder.add_edge(admin_node.__graphname__, END)
 
+# граф, в котором поиск по базе знаний запускается параллельно с классификацией сообщения
+speculative_builder = StateGraph(BitrixQAState, context_schema=BitrixQAContext)
+
+speculative_builder.add_node(classify_with_speculation.__graphname__, classify_with_speculation)
+speculative_builder.add_node(prepare_search_query.__graphname__, prepare_search_query)
+speculative_builder.add_node(lookup_cached_answer.__graphname__, lookup_cached_answer)
+add_answer_nodes(speculative_builder)
+
+speculative_builder.add_edge(START, classify_with_speculation.__graphname__)
+# для chat и objection спекулятивный поиск отменяется, при его ошибке поиск выполняется последовательно
+speculative_builder.add_conditional_edges(
+    classify_with_speculation.__graphname__,
+    speculative_routing,
+    {
+        "chat": admin_node.__graphname__,
+        "objection": END,
+        "query": prepare_search_query.__graphname__,
+        "hit": admin_node.__graphname__,
+        "selected": form_context.__graphname__,
+        "miss": shortlist_articles.__graphname__
+    }
+)
+speculative_builder.add_edge(prepare_search_query.__graphname__, lookup_cached_answer.__graphname__)
+speculative_builder.add_conditional_edges(
+    lookup_cached_answer.__graphname__,
+    answer_cache_routing,
+    {
+        "hit": admin_node.__graphname__,
+        "miss": shortlist_articles.__graphname__
+    }
+)
+
+
+@cache
 def get_simple_graph():
-    """Создать простой граф без памяти"""
+    """Создать простой граф без памяти. Граф компилируется один раз на процесс"""
     return builder.compile()
+
+
+@cache
+def get_speculative_graph():
+    """Создать граф со спекулятивным выполнением поиска по базе знаний"""
+    return speculative_builder.compile()
+
+
+def get_graph(speculative_execution: str = "off"):
+    """Получить скомпилированный граф для режима спекулятивного выполнения"""
+    if speculative_execution == "off":
+        return get_simple_graph()
+    return get_speculative_graph()
@@ -0,0 +1,113 @@
+import logging
+from typing import Any, Callable
+
+from pydantic import BaseModel, Field
+from langchain_core.runnables import Runnable
+from langchain_core.language_models import BaseChatModel
+
+logger = logging.getLogger(__name__)
+
+# ключ метаданных запуска модели с номером попытки: по нему стриминг отбрасывает частичный ответ модели,
+# после ошибки которой запрос повторен в pro_model
+ATTEMPT_METADATA_KEY = "model_router_attempt"
+
+
+class ModelCascade(BaseModel):
+    """Каскад моделей узла: сначала light_model, pro_model - только если легкой модели недостаточно"""
+
+    light_first: bool = Field(description="Начинать с light_model. False - всегда pro_model", default=True)
+    max_input_chars: int | None = Field(
+        description="Входные данные длиннее этого числа символов сразу отправляются в pro_model. None - без ограничения",
+        default=None
+    )
+    max_articles: int | None = Field(
+        description="При большем числе статей в ответе сразу используется pro_model. None - без ограничения",
+        default=None
+    )
+    escalate_on_error: bool = Field(
+        description="Повторить запрос в pro_model при ошибке light_model, в том числе разбора структурированного ответа",
+        default=True
+    )
+
+
+def default_model_cascades() -> dict[str, ModelCascade]:
+    """Каскады по умолчанию для узлов, которым может понадобиться pro_model"""
+    return {
+        "admin": ModelCascade(max_input_chars=8000, max_articles=3),
+        "session_end": ModelCascade(max_input_chars=6000),
+        "classify": ModelCascade(),
+    }
+
+
+class ModelRouter:
+    """Выбор модели для узлов по каскадам. Решения пишутся в лог и считаются для подбора порогов"""
+
+    def __init__(self, light_model: BaseChatModel, pro_model: BaseChatModel, cascades: dict[str, ModelCascade]):
+        self.light_model = light_model
+        self.pro_model = pro_model
+        self.cascades = cascades
+        self._decisions: dict[tuple[str, str, str], int] = {}
+
+    def choose(self, node: str, input_chars: int = 0, articles: int = 0) -> tuple[str, str]:
+        """Выбрать модель до вызова по сложности запроса. Возвращает (light или pro, причина)"""
+        cascade = self.cascades.get(node, ModelCascade())
+        if not cascade.light_first:
+            return "pro", "pro_only"
+        if cascade.max_input_chars is not None and input_chars > cascade.max_input_chars:
+            return "pro", "long_input"
+        if cascade.max_articles is not None and articles > cascade.max_articles:
+            return "pro", "many_articles"
+        return "light", "default"
+
+    async def ainvoke(
+        self,
+        node: str,
+        chain: Callable[[BaseChatModel], Runnable],
+        inputs: dict,
+        articles: int = 0,
+        accept: Callable[[Any], bool] | None = None
+    ) -> Any:
+        """Выполнить цепочку узла на выбранной модели.
+
+        Ответ light_model, отклоненный проверкой accept (например, пустой ответ или ответ не в ожидаемом формате),
+        или ошибка light_model приводят к повторному запросу в pro_model. Запуски моделей помечаются номером
+        попытки в метаданных ATTEMPT_METADATA_KEY.
+        """
+        cascade = self.cascades.get(node, ModelCascade())
+        input_chars = sum(len(value) for value in inputs.values() if isinstance(value, str))
+        model_name, reason = self.choose(node=node, input_chars=input_chars, articles=articles)
+        if model_name == "light":
+            try:
+                result = await self._chain(chain, self.light_model, attempt=0).ainvoke(inputs)
+            except Exception:
+                if not cascade.escalate_on_error:
+                    raise
+                logger.warning("Ошибка light_model в узле %s, запрос повторяется в pro_model", node, exc_info=True)
+                reason = "light_error"
+            else:
+                if accept is None or accept(result):
+                    self._record(node, model_name, reason, input_chars, articles)
+                    return result
+                reason = "rejected"
+            model_name = "pro"
+            attempt = 1
+        else:
+            attempt = 0
+        self._record(node, model_name, reason, input_chars, articles)
+        return await self._chain(chain, self.pro_model, attempt=attempt).ainvoke(inputs)
+
+    def metrics(self) -> dict[str, int]:
+        """Число решений по узлу, модели и причине"""
+        return {"/".join(key): count for key, count in self._decisions.items()}
+
+    @staticmethod
+    def _chain(chain: Callable[[BaseChatModel], Runnable], model: BaseChatModel, attempt: int) -> Runnable:
+        return chain(model).with_config(metadata={ATTEMPT_METADATA_KEY: attempt})
+
+    def _record(self, node: str, model_name: str, reason: str, input_chars: int, articles: int) -> None:
+        key = (node, model_name, reason)
+        self._decisions[key] = self._decisions.get(key, 0) + 1
+        logger.info(
+            "Выбор модели: узел=%s модель=%s причина=%s символов=%s статей=%s",
+            node, model_name, reason, input_chars, articles
+        )
@@ -1,30 +1,41 @@
-import json
+import asyncio
+import logging
 
 from langgraph.runtime import Runtime
-from langchain_core.runnables import RunnableLambda
 from langchain_core.messages import AIMessage
 
 from bitrix_qa_agent.context import BitrixQAContext
-from bitrix_qa_agent.state import BitrixQAState, RAGState
-from bitrix_qa_agent.utils import get_article_batches, get_sections_content
+from bitrix_qa_agent.state import BitrixQAState, AnswerState, RAGState, RAGAnswerState, SpeculativeState
+from bitrix_qa_agent.utils import get_article_batches, rank_categories
+from bitrix_qa_agent.context_packer import aget_encoding, pack_context
+from bitrix_qa_agent.selection import select_with_early_exit
 from bitrix_qa_agent.chains import (
-    choose_article_chain, generate_answer_chain, admin_answer_chain, classify_message_chain, prepare_query_chain
+    choose_article_chain, choose_category_chain, generate_answer_chain, admin_answer_chain, classify_message_chain, prepare_query_chain
 )
 
+logger = logging.getLogger(__name__)
 
-async def admin_node(state: BitrixQAState, runtime: Runtime[BitrixQAContext]) -> BitrixQAState:
+
+async def admin_node(state: AnswerState, runtime: Runtime[BitrixQAContext]) -> BitrixQAState:
     """Просто ответить на сообщение пользователя в режиме чата"""
     context = runtime.context or BitrixQAContext()
     chat = f"{state.chat_history}\nПользователь: {state.last_user_message}"
+    articles = 0
     if state.user_message_type == "knowledge_question":
         answer = state.answer
+        articles = len(set(state.relevant_articles_ids))
     else:
         answer = "нет"
-    answer = await admin_answer_chain(context.pro_model).ainvoke(
-        {
+    # пустой ответ легкой модели повторяется в pro_model
+    answer = await context.model_router.ainvoke(
+        node="admin",
+        chain=admin_answer_chain,
+        inputs={
             "chat": chat,
             "raw_answer": answer
-        }
+        },
+        articles=articles,
+        accept=lambda result: bool(result.strip())
     )
     return {"answer": answer, "messages": AIMessage(content=answer)}
 
@@ -33,8 +44,10 @@ admin_node.__graphname__ = "Ответить на сообщение польз
 async def classify_message_type(state: BitrixQAState, runtime: Runtime[BitrixQAContext]) -> BitrixQAState:
     """Получить тип сообщения пользователя"""
     context = runtime.context or BitrixQAContext()
-    message_type = (await classify_message_chain(context.light_model).ainvoke(
-        {
+    message_type = (await context.model_router.ainvoke(
+        node="classify",
+        chain=classify_message_chain,
+        inputs={
             "chat_history": state.chat_history,
             "last_user_message": state.last_user_message
         }
@@ -60,12 +73,83 @@ async def prepare_search_query(state: BitrixQAState, runtime: Runtime[BitrixQACo
 
 prepare_search_query.__graphname__ = "Получить запрос для поиска по базе знаний"
 
+async def lookup_cached_answer(state: RAGState, runtime: Runtime[BitrixQAContext]) -> RAGAnswerState:
+    """Найти готовый ответ на запрос в кеше"""
+    context = runtime.context or BitrixQAContext()
+    if context.answer_cache is None:
+        return {"answer_cache_hit": False}
+    catalog = await context.article_catalog.arefresh()
+    cached_answer = context.answer_cache.get(query=state.query, catalog_version=catalog.version)
+    if cached_answer is None:
+        return {"answer_cache_hit": False}
+    return {
+        "answer_cache_hit": True,
+        "relevant_articles_ids": cached_answer.relevant_articles_ids,
+        "answer": cached_answer.answer
+    }
+
+lookup_cached_answer.__graphname__ = "Найти ответ в кеше"
+
+async def shortlist_articles(state: RAGState, runtime: Runtime[BitrixQAContext]) -> RAGState:
+    """Отобрать статьи-кандидаты локальным поиском перед LLM-селектором"""
+    context = runtime.context or BitrixQAContext()
+    if context.retrieval_top_k is None:
+        return {"candidate_articles_ids": None}
+    candidate_articles_ids = await context.article_retriever.asearch(query=state.query, top_k=context.retrieval_top_k)
+    if not candidate_articles_ids:
+        # в запросе нет известных поиску слов (опечатки, названия латиницей): выбор идет по всему каталогу
+        return {"candidate_articles_ids": None}
+    return {"candidate_articles_ids": candidate_articles_ids}
+
+shortlist_articles.__graphname__ = "Отобрать статьи-кандидаты локальным поиском"
+
+async def route_categories(state: RAGState, runtime: Runtime[BitrixQAContext]) -> RAGState:
+    """Выбрать категории статей, в которых LLM-селектор будет искать релевантные статьи"""
+    context = runtime.context or BitrixQAContext()
+    if context.category_routing == "off":
+        return {"selected_categories": None}
+    catalog = await context.article_catalog.arefresh()
+    categories = list(catalog.categories)
+    if len(categories) <= 1:
+        return {"selected_categories": None}
+
+    if context.category_routing == "local":
+        candidate_articles_ids = state.candidate_articles_ids
+        if candidate_articles_ids is None:
+            candidate_articles_ids = await context.article_retriever.asearch(
+                query=state.query, top_k=context.category_routing_top_k
+            )
+        article_categories = {_id: article.category for _id, article in catalog.articles.items()}
+        selected_categories = rank_categories(
+            article_ids=candidate_articles_ids[:context.category_routing_top_k],
+            article_categories=article_categories,
+            max_categories=context.category_routing_max_categories
+        )
+    else:
+        chain = choose_category_chain(context.light_model, memo_store=context.memo_store)
+        try:
+            relevant_categories_ids = (await chain.ainvoke({
+                "categories": catalog.category_index,
+                "query": state.query,
+                "max_categories": context.category_routing_max_categories
+            })).relevant_categories_ids
+        except Exception:
+            # без категорий статьи выбираются по всему каталогу
+            return {"selected_categories": None}
+        selected_categories = [
+            categories[_id - 1] for _id in relevant_categories_ids or [] if 0 < _id <= len(categories)
+        ][:context.category_routing_max_categories]
+    return {"selected_categories": selected_categories or None}
+
+route_categories.__graphname__ = "Выбрать категории статей"
+
 async def get_relevant_articles_ids(state: RAGState, runtime: Runtime[BitrixQAContext]) -> RAGState:
-    """Получить релевантные ids по всем батчам"""
+    """Получить релевантные ids по батчам, упорядоченным по локальному поиску, с ранним завершением"""
 
     async def get_relevant_articles_ids_batch(_input: dict) -> list | None:
         """Получить ids по одному батчу"""
-        relevant_articles_ids_result = (await choose_article_chain(_input["model"]).ainvoke({
+        chain = choose_article_chain(_input["model"], memo_store=_input["memo_store"])
+        relevant_articles_ids_result = (await chain.ainvoke({
             "articles_metadata": _input["articles_metadata"],
             "query": _input["query"]
         })).relevant_articles_ids
@@ -74,38 +158,72 @@ async def get_relevant_articles_ids(state: RAGState, runtime: Runtime[BitrixQACo
         return None
 
     context = runtime.context or BitrixQAContext()
-    with open(context.articles_metadata_path, "r", encoding="utf-8") as f:
-        articles_metadata = json.load(f)
+    catalog = await context.article_catalog.arefresh()
+    articles_metadata = catalog.metadata
+    candidate_articles_ids = state.candidate_articles_ids
+    update = {}
+    if candidate_articles_ids is None and context.selection_policy.early_exit:
+        # без отбора кандидатов все статьи упорядочиваются локальным поиском, чтобы вероятные шли в первых батчах
+        candidate_articles_ids = await context.article_retriever.asearch(
+            query=state.query, top_k=len(articles_metadata)
+        )
+        ranked_articles_ids = set(candidate_articles_ids)
+        candidate_articles_ids = candidate_articles_ids + [
+            _id for _id in articles_metadata if _id not in ranked_articles_ids
+        ]
+        # упорядочивание сохраняется в состоянии, по нему form_context расставляет статьи в контексте
+        update["candidate_articles_ids"] = candidate_articles_ids
+    if candidate_articles_ids is not None:
+        articles_metadata = {
+            _id: articles_metadata[_id] for _id in candidate_articles_ids if _id in articles_metadata
+        }
+    if state.selected_categories:
+        # статьи без категории не отсекаются
+        selected_categories = set(state.selected_categories)
+        routed_articles_metadata = {
+            _id: metadata for _id, metadata in articles_metadata.items()
+            if catalog.articles[_id].category in selected_categories or not catalog.articles[_id].category
+        }
+        if routed_articles_metadata:
+            articles_metadata = routed_articles_metadata
     article_batches = get_article_batches(articles_metadata=articles_metadata, batch_size=context.articles_batch_size)
     _inputs = [
-        {"articles_metadata": batch_articles_metadata, "query": state.query, "model": context.light_model}
+        {
+            "articles_metadata": batch_articles_metadata,
+            "query": state.query,
+            "model": context.light_model,
+            "memo_store": context.memo_store
+        }
         for batch_articles_metadata in article_batches
     ]
-    relevant_articles_ids_all = []
-    runnable = RunnableLambda(func=get_relevant_articles_ids_batch)
-    async for idx, relevant_articles_ids in runnable.abatch_as_completed(_inputs, return_exceptions=True):
-        if isinstance(relevant_articles_ids, Exception):
-            continue
-        if relevant_articles_ids is not None:
-            relevant_articles_ids_all.extend(relevant_articles_ids)
+    relevant_articles_ids_all = await select_with_early_exit(
+        inputs=_inputs,
+        select=get_relevant_articles_ids_batch,
+        policy=context.selection_policy
+    )
 
-    return {"relevant_articles_ids": relevant_articles_ids_all}
+    update["relevant_articles_ids"] = relevant_articles_ids_all
+    return update
 
 get_relevant_articles_ids.__graphname__ = "Получить IDs статей, которые релевантны запросу"
 
 async def form_context(state: RAGState, runtime: Runtime[BitrixQAContext]) -> RAGState:
-    """Сформировать из найденных статей контекст"""
-    rag_context = []
+    """Сформировать из найденных статей контекст в пределах бюджета токенов"""
     context = runtime.context or BitrixQAContext()
-    with open(context.articles_metadata_path, "r", encoding="utf-8") as f:
-        articles_metadata = json.load(f)
-    for _id, metadata in articles_metadata.items():
-        if _id in state.relevant_articles_ids:
-            with open(f"{context.articles_files_path}/{metadata['article_filename']}", "r", encoding="utf-8") as f:
-                article_content = f.read()
-            sections_article_content = get_sections_content(article_content=article_content)
-            rag_context.append(sections_article_content)
-    return {"context": "\n\n".join(rag_context)}
+    catalog = await context.article_catalog.arefresh()
+    # статьи упорядочиваются по позиции в выдаче локального поиска, остальные идут после них
+    ranks = {_id: rank for rank, _id in enumerate(state.candidate_articles_ids or [])}
+    relevant_articles_ids = sorted(
+        dict.fromkeys(state.relevant_articles_ids),
+        key=lambda _id: ranks.get(_id, len(ranks))
+    )
+    await aget_encoding(context.tokenizer_encoding)
+    rag_context = pack_context(
+        articles=catalog.get_many(relevant_articles_ids),
+        token_budget=context.context_token_budget,
+        encoding_name=context.tokenizer_encoding
+    )
+    return {"context": rag_context}
 
 form_context.__graphname__ = "Сформировать контекст для ответа на вопрос"
 
@@ -116,3 +234,56 @@ async def generate_answer(state: RAGState, runtime: Runtime[BitrixQAContext]) ->
     return {"answer": answer}
 
 generate_answer.__graphname__ = "Сгенерировать ответ на вопрос по базе знаний"
+
+async def save_answer_to_cache(state: RAGAnswerState, runtime: Runtime[BitrixQAContext]) -> RAGAnswerState:
+    """Сохранить ответ по базе знаний в кеш"""
+    context = runtime.context or BitrixQAContext()
+    if context.answer_cache is not None and state.relevant_articles_ids and state.answer:
+        context.answer_cache.set(
+            query=state.query,
+            relevant_articles_ids=state.relevant_articles_ids,
+            answer=state.answer,
+            catalog_version=context.article_catalog.version
+        )
+    return {}
+
+save_answer_to_cache.__graphname__ = "Сохранить ответ в кеш"
+
+async def speculative_search(state: BitrixQAState, runtime: Runtime[BitrixQAContext]) -> SpeculativeState:
+    """Спекулятивно выполнить rag этап до получения типа сообщения. При ошибке результат пустой,
+    и поиск выполняется последовательно после классификации"""
+    context = runtime.context or BitrixQAContext()
+    try:
+        update = await prepare_search_query(state, runtime)
+        rag_state = RAGState(query=update["query"])
+        update.update(await lookup_cached_answer(rag_state, runtime))
+        if context.speculative_execution == "selection" and not update["answer_cache_hit"]:
+            rag_state = rag_state.model_copy(update=await shortlist_articles(rag_state, runtime))
+            rag_state = rag_state.model_copy(update=await route_categories(rag_state, runtime))
+            rag_state = rag_state.model_copy(update=await get_relevant_articles_ids(rag_state, runtime))
+            update.update(
+                candidate_articles_ids=rag_state.candidate_articles_ids,
+                selected_categories=rag_state.selected_categories,
+                relevant_articles_ids=rag_state.relevant_articles_ids,
+                speculative_selection=True
+            )
+    except Exception:
+        logger.warning("Ошибка спекулятивного поиска, поиск будет выполнен после классификации", exc_info=True)
+        return {}
+    return update
+
+async def classify_with_speculation(state: SpeculativeState, runtime: Runtime[BitrixQAContext]) -> SpeculativeState:
+    """Получить тип сообщения пользователя, параллельно спекулятивно выполняя поиск по базе знаний.
+    Для сообщений не по базе знаний поиск отменяется, не задерживая ответ"""
+    speculation = asyncio.create_task(speculative_search(state, runtime))
+    try:
+        update = await classify_message_type(state, runtime)
+        if update["user_message_type"] == "knowledge_question":
+            return {**update, **(await speculation)}
+    finally:
+        if not speculation.done():
+            speculation.cancel()
+            await asyncio.gather(speculation, return_exceptions=True)
+    return update
+
+classify_with_speculation.__graphname__ = "Получить тип сообщения со спекулятивным поиском по базе знаний"
@@ -0,0 +1,190 @@
+import re
+import math
+import heapq
+import asyncio
+import threading
+from collections import Counter, defaultdict
+from functools import lru_cache
+
+import snowballstemmer
+
+from bitrix_qa_agent.catalog import Article, ArticleCatalog
+
+TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+STOP_WORDS = frozenset({
+    "а", "без", "более", "бы", "был", "была", "были", "было", "быть", "в", "вам", "вас", "весь", "во", "вот", "все",
+    "всего", "вы", "где", "да", "даже", "для", "до", "его", "ее", "ей", "если", "есть", "еще", "же", "за", "и", "из",
+    "или", "им", "их", "к", "как", "какой", "когда", "кто", "ли", "либо", "мне", "может", "мы", "на", "над", "нам",
+    "нас", "не", "него", "нее", "нет", "ни", "них", "но", "ну", "о", "об", "однако", "он", "она", "они", "оно", "от",
+    "по", "под", "при", "с", "со", "так", "также", "такой", "там", "те", "тем", "то", "того", "тоже", "той", "только",
+    "том", "ты", "у", "уже", "хотя", "чего", "чей", "чем", "что", "чтобы", "чье", "эта", "эти", "это", "этот", "я",
+    "подскажите", "пожалуйста", "добрый", "день", "здравствуйте",
+})
+
+_stemmer = snowballstemmer.stemmer("russian")
+_stemmer_lock = threading.Lock()
+
+
+@lru_cache(maxsize=100_000)
+def stem(token: str) -> str:
+    """Получить основу слова стеммером Snowball для русского языка"""
+    with _stemmer_lock:
+        return _stemmer.stemWord(token)
+
+
+def tokenize(text: str) -> list[str]:
+    """Разбить текст на нормализованные основы слов без стоп-слов"""
+    tokens = []
+    for token in TOKEN_PATTERN.findall(text.lower().replace("ё", "е")):
+        if token in STOP_WORDS or (len(token) < 2 and not token.isdigit()):
+            continue
+        tokens.append(stem(token))
+    return tokens
+
+
+def article_fields(article: Article) -> list[tuple[str, int]]:
+    """Поля статьи для индексации с их весами"""
+    return [(article.title, 2), (article.problem, 1), (article.content, 1)]
+
+
+class BM25Index:
+    """Лексический индекс BM25 на инвертированных списках"""
+
+    def __init__(self, documents: dict[str, list[str]], k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.doc_ids = list(documents)
+        self.doc_lengths = [len(tokens) for tokens in documents.values()]
+        self.avg_doc_length = (sum(self.doc_lengths) / len(self.doc_lengths) if self.doc_lengths else 0.0) or 1.0
+        self.postings: dict[str, list[tuple[int, int]]] = defaultdict(list)
+        for doc_idx, tokens in enumerate(documents.values()):
+            for term, tf in Counter(tokens).items():
+                self.postings[term].append((doc_idx, tf))
+        n_docs = len(self.doc_ids)
+        self.idf = {
+            term: math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+            for term, postings in self.postings.items()
+        }
+
+    def search(self, query_tokens: list[str], top_k: int) -> list[tuple[str, float]]:
+        """Найти top_k документов по запросу"""
+        scores: dict[int, float] = defaultdict(float)
+        for term in set(query_tokens):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for doc_idx, tf in self.postings[term]:
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[doc_idx] / self.avg_doc_length)
+                scores[doc_idx] += idf * tf * (self.k1 + 1) / (tf + norm)
+        best = heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
+        return [(self.doc_ids[doc_idx], score) for doc_idx, score in best]
+
+
+class CharNgramVectorIndex:
+    """Векторный индекс по TF-IDF символьных n-грамм основ слов, считается локально без внешних моделей"""
+
+    def __init__(self, documents: dict[str, list[str]], n: int = 3):
+        self.n = n
+        self.doc_ids = list(documents)
+        doc_ngrams = [Counter(self.ngrams(tokens)) for tokens in documents.values()]
+        df = Counter(ngram for ngrams in doc_ngrams for ngram in ngrams)
+        n_docs = len(self.doc_ids)
+        self.idf = {ngram: math.log((1 + n_docs) / (1 + count)) + 1 for ngram, count in df.items()}
+        self.postings: dict[str, list[tuple[int, float]]] = defaultdict(list)
+        for doc_idx, ngrams in enumerate(doc_ngrams):
+            for ngram, weight in self._normalize(ngrams).items():
+                self.postings[ngram].append((doc_idx, weight))
+
+    def ngrams(self, tokens: list[str]) -> list[str]:
+        """Символьные n-граммы слов с маркерами границ"""
+        ngrams = []
+        for token in tokens:
+            token = f"#{token}#"
+            ngrams.extend(token[i:i + self.n] for i in range(max(len(token) - self.n + 1, 1)))
+        return ngrams
+
+    def _normalize(self, ngrams: Counter) -> dict[str, float]:
+        weights = {ngram: (1 + math.log(tf)) * self.idf.get(ngram, 0.0) for ngram, tf in ngrams.items()}
+        norm = math.sqrt(sum(weight * weight for weight in weights.values()))
+        if not norm:
+            return {}
+        return {ngram: weight / norm for ngram, weight in weights.items() if weight}
+
+    def search(self, query_tokens: list[str], top_k: int) -> list[tuple[str, float]]:
+        """Найти top_k документов по косинусной близости"""
+        scores: dict[int, float] = defaultdict(float)
+        for ngram, query_weight in self._normalize(Counter(self.ngrams(query_tokens))).items():
+            for doc_idx, doc_weight in self.postings.get(ngram, ()):
+                scores[doc_idx] += query_weight * doc_weight
+        best = heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
+        return [(self.doc_ids[doc_idx], score) for doc_idx, score in best]
+
+
+def reciprocal_rank_fusion(rankings: list[list[str]], k: int = 60) -> list[str]:
+    """Объединить несколько ранжирований методом Reciprocal Rank Fusion"""
+    scores: dict[str, float] = defaultdict(float)
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            scores[doc_id] += 1 / (k + rank + 1)
+    return sorted(scores, key=scores.get, reverse=True)
+
+
+class ArticleRetriever:
+    """Локальный предварительный отбор статей-кандидатов для LLM-селектора"""
+
+    def __init__(self, catalog: ArticleCatalog, use_vectors: bool = True):
+        self.catalog = catalog
+        self.use_vectors = use_vectors
+        self._version = None
+        self._bm25: BM25Index | None = None
+        self._vectors: CharNgramVectorIndex | None = None
+        self._lock = threading.Lock()
+
+    def build(self) -> None:
+        """Перестроить индексы, если каталог изменился"""
+        with self._lock:
+            articles = self.catalog.articles
+            if self._version == self.catalog.version:
+                return
+            documents = {}
+            for _id, article in articles.items():
+                tokens = []
+                for text, weight in article_fields(article):
+                    tokens.extend(tokenize(text) * weight)
+                documents[_id] = tokens
+            self._bm25 = BM25Index(documents)
+            self._vectors = CharNgramVectorIndex(documents) if self.use_vectors else None
+            self._version = self.catalog.version
+
+    def search(self, query: str, top_k: int) -> list[str]:
+        """Получить ID top_k статей-кандидатов в порядке убывания релевантности"""
+        self.build()
+        query_tokens = tokenize(query)
+        if not query_tokens:
+            return []
+        depth = top_k * 2 if self._vectors is not None else top_k
+        rankings = [[_id for _id, _ in self._bm25.search(query_tokens, depth)]]
+        if self._vectors is not None:
+            rankings.append([_id for _id, _ in self._vectors.search(query_tokens, depth)])
+        return reciprocal_rank_fusion(rankings)[:top_k]
+
+    async def asearch(self, query: str, top_k: int) -> list[str]:
+        """Асинхронный поиск: проверка каталога и поиск выполняются вне event loop"""
+        await self.catalog.arefresh()
+        return await asyncio.to_thread(self.search, query, top_k)
+
+
+_retrievers: dict[tuple[int, bool], ArticleRetriever] = {}
+_retrievers_lock = threading.Lock()
+
+
+def get_article_retriever(catalog: ArticleCatalog, use_vectors: bool = True) -> ArticleRetriever:
+    """Получить общий для процесса поисковик по каталогу"""
+    key = (id(catalog), use_vectors)
+    with _retrievers_lock:
+        retriever = _retrievers.get(key)
+        if retriever is None:
+            retriever = ArticleRetriever(catalog=catalog, use_vectors=use_vectors)
+            _retrievers[key] = retriever
+        return retriever
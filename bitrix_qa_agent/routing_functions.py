@@ -1,6 +1,25 @@
-from bitrix_qa_agent.state import BitrixQAState
+from bitrix_qa_agent.state import BitrixQAState, RAGState, SpeculativeState
 
 
 async def message_type_routing(state: BitrixQAState):
     """Роутинг на тип сообщения"""
     return state.user_message_type
+
+
+async def answer_cache_routing(state: RAGState):
+    """Роутинг по результату поиска ответа в кеше"""
+    return "hit" if state.answer_cache_hit else "miss"
+
+
+async def speculative_routing(state: SpeculativeState):
+    """Роутинг после классификации и спекулятивного rag этапа"""
+    if state.user_message_type != "knowledge_question":
+        return state.user_message_type
+    if state.query is None:
+        # спекулятивный поиск не удался
+        return "query"
+    if state.answer_cache_hit:
+        return "hit"
+    if state.speculative_selection:
+        return "selected"
+    return "miss"
@@ -0,0 +1,119 @@
+from typing import AsyncIterator
+
+import httpx
+from langchain_core.messages import AIMessageChunk
+from langgraph.graph.state import CompiledStateGraph
+
+from bitrix_qa_agent.state import InputState
+from bitrix_qa_agent.graph import get_graph
+from bitrix_qa_agent.nodes import admin_node
+from bitrix_qa_agent.model_router import ATTEMPT_METADATA_KEY
+from bitrix_qa_agent.chains.chains import is_support_session_end_chain, summarize_history_chain
+from bitrix_qa_agent.context import BitrixQAContext, openrouter_chat_model, LIGHT_MODEL_NAME, PRO_MODEL_NAME
+
+
+def create_http_async_client(
+    max_connections: int = 100,
+    max_keepalive_connections: int = 20,
+    keepalive_expiry: float = 60.0
+) -> httpx.AsyncClient:
+    """HTTP клиент с пулом keep-alive соединений для запросов к LLM"""
+    return httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry
+        ),
+        timeout=httpx.Timeout(120.0, connect=10.0)
+    )
+
+
+class BitrixQAAgent:
+    """Рантайм агента: граф компилируется один раз, клиенты моделей живут всё время работы процесса"""
+
+    def __init__(self, context: BitrixQAContext | None = None, graph: CompiledStateGraph | None = None):
+        self.http_async_client = None
+        if context is None:
+            self.http_async_client = create_http_async_client()
+            context = BitrixQAContext(
+                light_model=openrouter_chat_model(
+                    LIGHT_MODEL_NAME, http_async_client=self.http_async_client
+                ).chat_model,
+                pro_model=openrouter_chat_model(
+                    PRO_MODEL_NAME, http_async_client=self.http_async_client
+                ).chat_model
+            )
+        self.context = context
+        self.graph = graph or get_graph(self.context.speculative_execution)
+
+    async def answer(self, chat_history: str | None, last_user_message: str) -> str:
+        """Получить ответ на сообщение пользователя. Возвращает need_human, если нужен специалист"""
+        if chat_history is None:
+            chat_history = ""
+        _input = InputState(chat_history=chat_history, last_user_message=last_user_message)
+        result = await self.graph.ainvoke(input=_input, context=self.context)
+        if result["user_message_type"] == "objection":
+            return "need_human"
+        return result["answer"]
+
+    async def astream_answer(self, chat_history: str | None, last_user_message: str) -> AsyncIterator[str]:
+        """Стримить ответ на сообщение пользователя.
+
+        Отдает накопленный текст ответа по мере генерации токенов финального этапа (admin_node),
+        последним значением всегда идет полный ответ. Если ответ повторен другой моделью, накопленный текст
+        начинается заново и не является продолжением предыдущего значения. Для objection отдает только need_human.
+        """
+        if chat_history is None:
+            chat_history = ""
+        _input = InputState(chat_history=chat_history, last_user_message=last_user_message)
+        streamed_answer = ""
+        streamed_attempt = 0
+        result = {}
+        async for mode, chunk in self.graph.astream(
+            input=_input,
+            context=self.context,
+            stream_mode=["messages", "values"]
+        ):
+            if mode == "values":
+                result = chunk
+                continue
+            message_chunk, metadata = chunk
+            # в режиме messages также приходят целые сообщения из обновлений состояния
+            if not isinstance(message_chunk, AIMessageChunk) or metadata.get("langgraph_node") != admin_node.__graphname__:
+                continue
+            attempt = metadata.get(ATTEMPT_METADATA_KEY, 0)
+            if attempt < streamed_attempt:
+                continue
+            if attempt > streamed_attempt:
+                # ответ повторен в pro_model после ошибки light_model: частичный ответ отбрасывается
+                streamed_attempt = attempt
+                streamed_answer = ""
+            if message_chunk.text:
+                streamed_answer += message_chunk.text
+                yield streamed_answer
+        if result.get("user_message_type") == "objection":
+            yield "need_human"
+        elif result.get("answer") is not None and result["answer"] != streamed_answer:
+            yield result["answer"]
+
+    async def is_support_session_end(self, chat: str) -> bool:
+        """Определить, завершена сессия поддержки или нет"""
+        # ответ не в формате 0 или 1 повторяется в pro_model
+        result = await self.context.model_router.ainvoke(
+            node="session_end",
+            chain=is_support_session_end_chain,
+            inputs={"chat": chat},
+            accept=lambda result: result.strip() in ("0", "1")
+        )
+        return result.strip() == "1"
+
+    async def summarize_history(self, summary: str | None, messages: str) -> str:
+        """Дополнить краткое содержание диалога сообщениями, которые в него еще не вошли"""
+        return await summarize_history_chain(model=self.context.light_model).ainvoke(
+            {"summary": summary or "нет", "messages": messages}
+        )
+
+    async def aclose(self) -> None:
+        """Закрыть HTTP соединения рантайма"""
+        if self.http_async_client is not None:
+            await self.http_async_client.aclose()
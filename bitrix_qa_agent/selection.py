@@ -0,0 +1,135 @@
+import time
+import asyncio
+import logging
+from typing import Awaitable, Callable, TypeVar
+
+from pydantic import BaseModel, Field
+
+T = TypeVar("T")
+
+logger = logging.getLogger(__name__)
+
+
+class SelectionPolicy(BaseModel):
+    """Политика раннего завершения выбора статей по батчам"""
+
+    name: str = Field(description="Название политики для метрик", default="early_exit")
+    min_relevant: int | None = Field(
+        description="Сколько релевантных статей достаточно, чтобы не ждать остальные батчи. None - ждать все",
+        default=5
+    )
+    deadline: float | None = Field(
+        description=(
+            "Через сколько секунд прекратить ожидание батчей, если уже найдена хотя бы одна статья. "
+            "None - без ограничения"
+        ),
+        default=10.0
+    )
+    max_concurrency: int | None = Field(
+        description=(
+            "Сколько батчей обрабатывать одновременно. Батчи запускаются по порядку, поэтому первыми "
+            "завершаются самые вероятные, а последние батчи при раннем завершении не отправляются в модель. "
+            "None - все сразу"
+        ),
+        default=4
+    )
+
+    @property
+    def early_exit(self) -> bool:
+        """Может ли выбор завершиться до обработки всех батчей"""
+        return self.min_relevant is not None or self.deadline is not None
+
+
+class SelectionMetrics:
+    """Счетчики выбора статей по политикам: сколько вызовов модели сделано и сэкономлено ранним завершением"""
+
+    def __init__(self):
+        self._metrics: dict[str, dict[str, int]] = {}
+
+    def record(self, policy: str, batches: int, started: int, cancelled: int, reason: str) -> None:
+        """Учесть один выбор статей"""
+        metrics = self._metrics.setdefault(policy, {
+            "runs": 0, "batches": 0, "calls": 0, "saved_calls": 0, "cancelled_calls": 0,
+            "complete": 0, "enough": 0, "deadline": 0
+        })
+        metrics["runs"] += 1
+        metrics["batches"] += batches
+        metrics["calls"] += started
+        metrics["saved_calls"] += batches - started
+        metrics["cancelled_calls"] += cancelled
+        metrics[reason] += 1
+
+    def snapshot(self) -> dict[str, dict[str, int]]:
+        """Текущие значения счетчиков"""
+        return {policy: dict(metrics) for policy, metrics in self._metrics.items()}
+
+
+selection_metrics = SelectionMetrics()
+
+
+async def log_selection_metrics(interval: float = 60.0, metrics: SelectionMetrics = selection_metrics) -> None:
+    """Периодически писать метрики выбора статей в лог"""
+    while True:
+        await asyncio.sleep(interval)
+        logger.info("Выбор статей: %s", metrics.snapshot())
+
+
+async def select_with_early_exit(
+    inputs: list[T],
+    select: Callable[[T], Awaitable[list[str] | None]],
+    policy: SelectionPolicy,
+    metrics: SelectionMetrics = selection_metrics
+) -> list[str]:
+    """Выбрать релевантные IDs по батчам, упорядоченным от самых вероятных.
+
+    Выбор завершается, когда набрано policy.min_relevant статей или прошел policy.deadline и есть хотя бы
+    одна статья. Незавершенные вызовы отменяются, незапущенные не выполняются. Ошибки батчей пропускаются.
+    """
+    semaphore = asyncio.Semaphore(policy.max_concurrency) if policy.max_concurrency else None
+    started = 0
+
+    async def run(_input: T) -> list[str] | None:
+        nonlocal started
+        if semaphore is None:
+            started += 1
+            return await select(_input)
+        async with semaphore:
+            started += 1
+            return await select(_input)
+
+    tasks = [asyncio.create_task(run(_input)) for _input in inputs]
+    relevant_articles_ids = []
+    pending = set(tasks)
+    deadline = time.monotonic() + policy.deadline if policy.deadline is not None else None
+    reason = "complete"
+    try:
+        while pending:
+            timeout = None
+            if deadline is not None:
+                timeout = max(deadline - time.monotonic(), 0)
+            done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            # результаты в порядке батчей, чтобы более вероятные статьи шли первыми
+            for task in sorted(done, key=tasks.index):
+                if task.exception() is None and task.result() is not None:
+                    relevant_articles_ids.extend(task.result())
+            if not pending:
+                break
+            if policy.min_relevant is not None and len(set(relevant_articles_ids)) >= policy.min_relevant:
+                reason = "enough"
+                break
+            if deadline is not None and time.monotonic() >= deadline:
+                if relevant_articles_ids:
+                    reason = "deadline"
+                    break
+                # пока ничего не найдено, ждем остальные батчи
+                deadline = None
+    finally:
+        # запущенные, но не завершенные вызовы модели
+        cancelled = started - (len(tasks) - len(pending))
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+    metrics.record(
+        policy=policy.name, batches=len(inputs), started=started, cancelled=cancelled, reason=reason
+    )
+    return relevant_articles_ids
@@ -0,0 +1,22 @@
+import re
+
+# Фразы, с которыми обычно завершается сессия поддержки: благодарность, подтверждение решения,
+# неактуальность вопроса и прощание специалиста. Проверка только отбирает диалоги для проверки моделью,
+# поэтому лишние срабатывания допустимы, пропуски - нет
+CLOSING_PATTERN = re.compile(
+    "|".join((
+        r"спасиб", r"благодар", r"помогл", r"разобрал",
+        r"(все|всё)\s+(работает|получилось|понятно|ясно|ок)", r"получилось", r"заработал",
+        r"(решен|решил|решилась|решилось|закрыт)",
+        r"не\s+(надо|нужно|актуальн)", r"неактуальн", r"отбой",
+        r"хорошего\s+(дня|вечера)", r"всего\s+(доброго|хорошего)", r"до\s+свидан",
+        r"рад[аы]?\s+(был[аио]?\s+)?помочь", r"обращайтесь",
+        r"ничем\s+не\s+(можем|сможем)\s+помочь", r"ограничение\s+системы", r"заверш",
+    )),
+    re.IGNORECASE
+)
+
+
+def has_closing_signal(text: str) -> bool:
+    """Есть ли в сообщении признаки завершения диалога"""
+    return CLOSING_PATTERN.search(text) is not None
@@ -14,11 +14,37 @@ class InputState(BaseModel):
 class RAGState(BaseModel):
     """Состояние для rag этапа"""
     query: str = Field(description="Вопрос пользователя")
+    candidate_articles_ids: list[str] | None = Field(
+        description="IDs статей-кандидатов локального поиска в порядке релевантности. None - все статьи",
+        default=None
+    )
+    selected_categories: list[str] | None = Field(
+        description="Категории, статьи которых передаются LLM-селектору. None - все категории",
+        default=None
+    )
     relevant_articles_ids: list[str] = Field(description="IDs релевантных статей для текущего запроса.", default_factory=list)
     context: str | None = Field(description="Контекст для ответа на вопрос", default=None)
+    answer_cache_hit: bool = Field(description="Ответ на запрос найден в кеше", default=False)
+
+
+class RAGAnswerState(RAGState):
+    """Состояние rag этапа после генерации ответа"""
+    answer: str | None = Field(description="Ответ на вопрос", default=None)
 
 
 class BitrixQAState(InputState):
     """Основное состояние графа"""
     user_message_type: str | None = Field(description="Тип сообщения пользователя", default=None)
     answer: str | None = Field(description="Ответ на вопрос", default=None)
+
+
+class AnswerState(BitrixQAState):
+    """Состояние графа для финального ответа"""
+    relevant_articles_ids: list[str] = Field(description="IDs статей, по которым составлен ответ", default_factory=list)
+
+
+class SpeculativeState(BitrixQAState):
+    """Состояние графа со спекулятивным выполнением rag этапа параллельно с классификацией"""
+    query: str | None = Field(description="Вопрос пользователя", default=None)
+    answer_cache_hit: bool = Field(description="Ответ на запрос найден в кеше", default=False)
+    speculative_selection: bool = Field(description="Статьи уже выбраны спекулятивно", default=False)
@@ -17,8 +17,41 @@ def get_article_batches(articles_metadata: dict[str, dict], batch_size: int = 10
     return article_batches
 
 
-def get_sections_content(article_content: str) -> str:
-    """Получить текст из разделов РЕШЕНИЕ, ВАЖНО и ТЕХНИЧЕСКИЕ ДЕТАЛИ"""
+def get_category_index(categories: dict[str, list[str]], examples: int = 3) -> str:
+    """Получить компактный список категорий с номерами, числом статей и примерами тем"""
+
+    category_index = []
+    for category_id, (category, titles) in enumerate(categories.items(), start=1):
+        category_index.append(
+            f"ID категории: {category_id}\nКатегория: {category} ({len(titles)} статей)\n"
+            f"Примеры тем: {'; '.join(titles[:examples])}"
+        )
+    return "\n\n".join(category_index)
+
+
+def rank_categories(article_ids: list[str], article_categories: dict[str, str | None], max_categories: int = 3) -> list[str]:
+    """Получить категории статей, упорядоченных по релевантности, по сумме обратных рангов статей"""
+
+    scores = {}
+    for rank, _id in enumerate(article_ids):
+        category = article_categories.get(_id)
+        if category:
+            scores[category] = scores.get(category, 0.0) + 1 / (rank + 1)
+    return sorted(scores, key=scores.get, reverse=True)[:max_categories]
+
+
+def get_category(article_content: str) -> str | None:
+    """Получить категорию статьи из заголовка Категория:"""
+
+    for line in article_content.split('\n'):
+        line = line.strip()
+        if line.startswith("Категория:"):
+            return line.removeprefix("Категория:").strip() or None
+    return None
+
+
+def get_sections(article_content: str) -> dict[str, str]:
+    """Получить текст разделов РЕШЕНИЕ, ВАЖНО и ТЕХНИЧЕСКИЕ ДЕТАЛИ по отдельности"""
 
     sections = {}
     current_section = None
@@ -42,10 +75,13 @@ def get_sections_content(article_content: str) -> str:
             sections[current_section].append(line)
 
     target_sections = ["РЕШЕНИЕ", "ВАЖНО", "ТЕХНИЧЕСКИЕ ДЕТАЛИ"]
-    result_parts = []
+    return {
+        section: '\n'.join(sections[section])
+        for section in target_sections
+        if section in sections and sections[section]
+    }
 
-    for section in target_sections:
-        if section in sections and sections[section]:
-            result_parts.extend(sections[section])
 
-    return '\n'.join(result_parts)
\ No newline at end of file
+def get_sections_content(article_content: str) -> str:
+    """Получить текст из разделов РЕШЕНИЕ, ВАЖНО и ТЕХНИЧЕСКИЕ ДЕТАЛИ"""
+    return '\n'.join(get_sections(article_content).values())
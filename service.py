@@ -1,34 +1,45 @@
+from typing import AsyncIterator
+
 from dotenv import load_dotenv
 
-from bitrix_qa_agent.state import InputState
-from bitrix_qa_agent.context import BitrixQAContext
-from bitrix_qa_agent.chains.chains import is_support_session_end_chain
-from bitrix_qa_agent.graph import get_simple_graph
+from bitrix_qa_agent.runtime import BitrixQAAgent
+from bitrix_qa_agent.session_end import has_closing_signal
+from bitrix_qa_agent.selection import log_selection_metrics
 
 
 load_dotenv()
 
+_agent: BitrixQAAgent | None = None
+
+
+def get_agent() -> BitrixQAAgent:
+    """Получить общий для процесса рантайм агента"""
+    global _agent
+    if _agent is None:
+        _agent = BitrixQAAgent()
+    return _agent
+
+
+async def close_agent() -> None:
+    """Освободить ресурсы рантайма агента"""
+    global _agent
+    if _agent is not None:
+        await _agent.aclose()
+        _agent = None
+
 
 async def get_answer(chat_history: str | None, last_user_message) -> str:
     """Основная функция для получения ответа"""
-    context = BitrixQAContext()
-    bitrix_qa_graph = get_simple_graph()
-    if chat_history is None:
-        chat_history = ""
-    _input = InputState(chat_history=chat_history, last_user_message=last_user_message)
-    result = await bitrix_qa_graph.ainvoke(
-        input=_input,
-        context=context
-    )
-    if result["user_message_type"] == "objection":
-        return "need_human"
-    else:
-        return result["answer"]
+    return await get_agent().answer(chat_history=chat_history, last_user_message=last_user_message)
+
+def stream_answer(chat_history: str | None, last_user_message: str) -> AsyncIterator[str]:
+    """Стримить ответ: накопленный текст ответа по мере генерации, для objection - need_human"""
+    return get_agent().astream_answer(chat_history=chat_history, last_user_message=last_user_message)
 
 async def get_answer_test(chat_history: str | None, last_user_message: str):
     from bitrix_qa_agent.chains.chains import admin_answer_chain
 
-    context = BitrixQAContext()
+    context = get_agent().context
     if "специалист" in last_user_message:
         return "need_human"
     else:
@@ -41,13 +52,14 @@ async def get_answer_test(chat_history: str | None, last_user_message: str):
 
 async def check_support_session_end(chat: str) -> bool:
     """Определить, завершена сессия поддержки или нет"""
-    context = BitrixQAContext()
-    result = await is_support_session_end_chain(model=context.pro_model).ainvoke(
-        {
-            "chat": chat
-        }
-    )
-    if result == "1":
-        return True
-    else:
-        return False
\ No newline at end of file
+    return await get_agent().is_support_session_end(chat=chat)
+
+
+async def summarize_history(summary: str | None, messages: str) -> str:
+    """Дополнить краткое содержание диалога новыми сообщениями"""
+    return await get_agent().summarize_history(summary=summary, messages=messages)
+
+
+def might_be_support_session_end(message: str) -> bool:
+    """Быстрая проверка без модели: есть ли в сообщении признаки завершения диалога"""
+    return has_closing_signal(message)
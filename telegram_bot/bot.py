@@ -1,34 +1,88 @@
 import os
 import sys
+import signal
 import asyncio
 import logging
+import datetime
 
 from dotenv import load_dotenv
 from aiogram.enums import ParseMode
 from aiogram import Bot, Dispatcher, types
 from aiogram.client.default import DefaultBotProperties
 from aiogram.methods.read_business_message import ReadBusinessMessage
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
 
 from telegram_bot.database import crud, models
 from telegram_bot.database.models import (
-    Message, MessageType, MessageRole, AssistantType, SupportSession, SupportStatus
+    Message, MessageType, MessageRole, AssistantType, SupportSession, SupportStatus, ScheduledFollowup
 )
 from telegram_bot.utils import (
-    create_chat,
     has_media_content,
     get_media_info,
     get_or_create_support_session,
     get_chat_history,
+    message_timestamp,
     should_send_auto_reply
 )
-from service import get_answer, check_support_session_end
+from service import (
+    stream_answer, check_support_session_end, might_be_support_session_end, summarize_history, get_agent,
+    close_agent, log_selection_metrics
+)
+from telegram_bot.streaming import MessageStreamer
+from telegram_bot.dispatcher import ChatWorkQueue
+from telegram_bot.followups import FollowupScheduler
+from telegram_bot.session_end import SessionEndChecker
+from telegram_bot.history_summary import HistorySummarizer
+from telegram_bot.leases import ChatLeaseManager
+from telegram_bot.coalescer import MessageCoalescer, PendingMessages
+from telegram_bot.session_history import SessionHistory, session_histories
+from telegram_bot.database.journal import message_journal
+from telegram_bot.database.base import engine, listen_engine, log_pool_metrics
+from telegram_bot.database.archive import run_archiver
+from telegram_bot.database.session_cache import active_sessions
 from telegram_bot.constants import NEED_HUMAN_MESSAGE, AUTO_REPLY, CHECK_USER_MESSAGE, NEED_HUMAN_MESSAGE_WITH_GREETINGS
 
 
+logger = logging.getLogger(__name__)
+
 load_dotenv()
 TOKEN = os.environ["TELEGRAM_API_TOKEN"]
 TECH_SUPPORT_ID = os.environ["TECH_SUPPORT_ID"]
 OPERATOR_ID = os.environ["OPERATOR_ID"]
+# максимальное число одновременно обрабатываемых сообщений и размер очереди
+MAX_CONCURRENT_PIPELINES = int(os.getenv("MAX_CONCURRENT_PIPELINES", 8))
+MAX_PENDING_MESSAGES = int(os.getenv("MAX_PENDING_MESSAGES", 1000))
+# окно в секундах, в течение которого идущие подряд сообщения клиента объединяются в один запрос к агенту
+MESSAGE_COALESCE_WINDOW = float(os.getenv("MESSAGE_COALESCE_WINDOW", 2.0))
+# число последних сообщений, по которым модель определяет окончание сессии,
+# и число сообщений, после которого проверка запускается даже без признаков завершения диалога
+SESSION_END_CHECK_WINDOW = int(os.getenv("SESSION_END_CHECK_WINDOW", 6))
+SESSION_END_CHECK_MAX_UNCHECKED = int(os.getenv("SESSION_END_CHECK_MAX_UNCHECKED", 10))
+# число последних сообщений, которые агент получает дословно, более ранние заменяются кратким содержанием,
+# и число вышедших за эти пределы сообщений, после которого краткое содержание дополняется
+HISTORY_KEEP_MESSAGES = int(os.getenv("HISTORY_KEEP_MESSAGES", 10))
+HISTORY_SUMMARY_MIN_BATCH = int(os.getenv("HISTORY_SUMMARY_MIN_BATCH", 4))
+# polling - один процесс получает обновления сам, webhook - обновления принимает HTTP-сервер,
+# несколько реплик которого могут работать за балансировщиком
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")  # внешний адрес, по которому Telegram отправляет обновления
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+WEB_SERVER_HOST = os.getenv("WEB_SERVER_HOST", "0.0.0.0")
+WEB_SERVER_PORT = int(os.getenv("WEB_SERVER_PORT", 8080))
+# аренда чатов в базе, чтобы сообщения одного чата не обрабатывались разными репликами одновременно
+CHAT_LEASES = os.getenv("CHAT_LEASES", str(BOT_MODE == "webhook")).lower() == "true"
+CHAT_LEASE_TTL = float(os.getenv("CHAT_LEASE_TTL", 60))
+# сбрасывать кеш активных сессий по изменениям из других реплик бота, нужно прямое подключение к Postgres (DB_LISTEN_URL)
+ACTIVE_SESSION_CACHE_SYNC = os.getenv("ACTIVE_SESSION_CACHE_SYNC", str(CHAT_LEASES)).lower() == "true"
+# через сколько дней после завершения сессии ее сообщения переносятся в архив, 0 - не архивировать
+ARCHIVE_AFTER_DAYS = float(os.getenv("ARCHIVE_AFTER_DAYS", 30))
+ARCHIVE_INTERVAL = float(os.getenv("ARCHIVE_INTERVAL", 3600))
+# через сколько секунд после ответа бота спросить клиента, все ли понятно
+FOLLOWUP_DELAY = float(os.getenv("FOLLOWUP_DELAY", 1800))
+# через сколько секунд неотправленное напоминание может забрать другая реплика
+FOLLOWUP_CLAIM_TTL = float(os.getenv("FOLLOWUP_CLAIM_TTL", 300))
 
 dp = Dispatcher()
 bot = Bot(
@@ -37,46 +91,117 @@ bot = Bot(
 )
 
 
+def forget_chat(chat_id: str) -> None:
+    """Сбросить локальные кеши чата, который обрабатывала другая реплика"""
+    active_sessions.invalidate(chat_id)
+    session_histories.invalidate_chat(chat_id)
+
+
+async def flush_chat(chat_id: str) -> None:
+    """Записать сообщения чата в базу перед передачей чата другой реплике"""
+    await message_journal.flush(chat_id)
+
+chat_leases = ChatLeaseManager(ttl=CHAT_LEASE_TTL, before_release=flush_chat, on_takeover=forget_chat)
+chat_work_queue = ChatWorkQueue(
+    max_concurrency=MAX_CONCURRENT_PIPELINES,
+    max_pending=MAX_PENDING_MESSAGES,
+    chat_lock=chat_leases.hold if CHAT_LEASES else None
+)
+
+
+async def submit_agent_answer(pending_messages: PendingMessages):
+    """Поставить ответ агента на накопленные сообщения в очередь чата"""
+    await chat_work_queue.submit(
+        pending_messages.chat_id,
+        lambda: answer_client_messages(pending_messages=pending_messages)
+    )
+
+message_coalescer = MessageCoalescer(window=MESSAGE_COALESCE_WINDOW, on_ready=submit_agent_answer)
+background_tasks: list[asyncio.Task] = []
+
+
 @dp.business_message()
 async def handle_business_message(message: types.Message):
+    """Постановка сообщения в очередь чата: сообщения одного чата обрабатываются по порядку"""
+    # время сообщения фиксируется при получении, до ожидания очереди и аренды чата
+    created_at = message_timestamp(message, received_at=datetime.datetime.utcnow())
+    if message.from_user.id != int(TECH_SUPPORT_ID):
+        # новое сообщение клиента отменяет ответ агента на предыдущие, они будут объединены
+        message_coalescer.interrupt(str(message.chat.id))
+    await chat_work_queue.submit(
+        str(message.chat.id),
+        lambda: process_business_message(message=message, created_at=created_at)
+    )
+
+
+async def process_business_message(message: types.Message, created_at: datetime.datetime):
     """Обработка сообщений"""
     print(message.text)
     if message.from_user.id == int(TECH_SUPPORT_ID):
         print("Обработка сообщения специалиста")
-        await handle_specialist_message(message=message)
+        await handle_specialist_message(message=message, created_at=created_at)
     else:
         print("Обработка сообщения пользователя")
-        await handle_client_message(message=message)
+        await handle_client_message(message=message, created_at=created_at)
 
 
-followup_tasks: dict[str, asyncio.Task] = {}
-async def schedule_followup(chat_id: str, business_connection_id: str, support_session_id: str) -> None:
-    """Отправить сообщение с вопросом 'все ли клиенту понятно'"""
-    await asyncio.sleep(1800)
-    await crud.add_message(
-        support_session_id=support_session_id,
+async def send_followup(followup: ScheduledFollowup) -> None:
+    """Отправить сообщение с вопросом 'все ли клиенту понятно' и удалить напоминание из базы"""
+    await bot.send_message(
+        chat_id=followup.chat_id,
+        text=CHECK_USER_MESSAGE,
+        business_connection_id=followup.business_connection_id
+    )
+    await session_histories.add_message(
+        support_session_id=followup.support_session_id,
         content=CHECK_USER_MESSAGE,
         role=MessageRole.system
     )
-    await bot.send_message(
-        chat_id=chat_id,
-        text=CHECK_USER_MESSAGE,
-        business_connection_id=business_connection_id
+    await crud.complete_followup(chat_id=followup.chat_id, due_at=followup.due_at)
+
+
+
+async def submit_followup(followup: ScheduledFollowup) -> None:
+    """Поставить отправку напоминания в очередь чата, чтобы она шла по порядку с сообщениями чата"""
+    await chat_work_queue.submit(followup.chat_id, lambda: send_followup(followup))
+
+followup_scheduler = FollowupScheduler(on_due=submit_followup, claim_ttl=FOLLOWUP_CLAIM_TTL)
+
+
+async def end_support_session(support_session: SupportSession) -> None:
+    """Завершить сессию поддержки, определенную как оконченная"""
+    await crud.update_session_status(
+        session_id=support_session.id,
+        status=SupportStatus.end
     )
+    session_histories.invalidate(support_session.id)
+    await followup_scheduler.cancel(support_session.chat_id)
+
+session_end_checker = SessionEndChecker(
+    check=check_support_session_end,
+    on_end=end_support_session,
+    has_closing_signal=might_be_support_session_end,
+    window=SESSION_END_CHECK_WINDOW,
+    max_unchecked=SESSION_END_CHECK_MAX_UNCHECKED
+)
+
+history_summarizer = HistorySummarizer(
+    summarize=summarize_history,
+    save=crud.update_history_summary,
+    keep_last=HISTORY_KEEP_MESSAGES,
+    min_batch=HISTORY_SUMMARY_MIN_BATCH
+)
 
 async def switch_to_human_specialist(
     support_session: SupportSession,
     chat_id: str,
     username: str,
-    business_connection_id: str | None = None
+    business_connection_id: str | None = None,
+    streamer: MessageStreamer | None = None
 ) -> None:
     """Переключить сессию на специалиста и отправляет сообщение пользователю"""
     # проверяем, первое ли это сообщение клиента
-    support_session_messages = await crud.get_all_messages(support_session_id=support_session.id)
-    user_messages = 0
-    for message in support_session_messages:
-        if message.role == MessageRole.user:
-            user_messages += 1
+    user_messages = await session_histories.count_messages(support_session.id, role=MessageRole.user)
     if user_messages == 1:
         text = NEED_HUMAN_MESSAGE_WITH_GREETINGS
     else:
@@ -86,11 +211,14 @@ async def switch_to_human_specialist(
         session_id=support_session.id,
         assistant_type=AssistantType.human
     )
-    await bot.send_message(
-        chat_id=chat_id,
-        text=text,
-        business_connection_id=business_connection_id
-    )
+    if streamer is not None:
+        await streamer.finish(text)
+    else:
+        await bot.send_message(
+            chat_id=chat_id,
+            text=text,
+            business_connection_id=business_connection_id
+        )
     # отправка уведомления специалисту
     chat_link = f"https://t.me/{username}"
     await bot.send_message(
@@ -104,12 +232,21 @@ async def switch_to_human_specialist(
 
 
 async def get_agent_answer(
-    support_session_messages: list[Message],
-    user_message: str
+    session_history: SessionHistory,
+    user_message: str,
+    pending_messages_count: int = 1,
+    streamer: MessageStreamer | None = None
 ) -> tuple[str, str | None]:
-    """Получить ответ от агента"""
-    chat_history = await get_chat_history(support_session_messages=support_session_messages)
-    answer = await get_answer(chat_history=chat_history, last_user_message=user_message)
+    """Получить ответ от агента, показывая его клиенту по мере генерации"""
+    chat_history = await get_chat_history(
+        session_history=session_history,
+        pending_messages_count=pending_messages_count,
+        bounded=True
+    )
+    answer = ""
+    async for answer in stream_answer(chat_history=chat_history, last_user_message=user_message):
+        if streamer is not None and answer != "need_human":
+            await streamer.update(answer)
     return answer, chat_history
 
 
@@ -117,72 +254,72 @@ async def process_agent_response(
     support_session: SupportSession,
     answer: str,
     chat_id: str,
-    business_connection_id: str | None = None
+    business_connection_id: str | None = None,
+    streamer: MessageStreamer | None = None
 ) -> None:
-    """Обработка ответа агента: сохранение в БД, установка таймера, отправка сообщения клиенту"""
-    await crud.add_message(
+    """Обработка ответа агента: сохранение в БД, отправка сообщения клиенту, установка таймера,
+    фоновая проверка окончания диалога и обновление краткого содержания истории"""
+    await session_histories.add_message(
         support_session_id=support_session.id,
         content=answer,
         role=MessageRole.assistant,
         assistant_type=AssistantType.ai
     )
-    # удаление старой задачи с сообщением с напоминанием
-    old_task = followup_tasks.pop(chat_id, None)
-    if old_task:
-        old_task.cancel()
-    # Проверка на окончание диалога
-    support_session_messages = await crud.get_all_messages(support_session_id=support_session.id)
-    chat = create_chat(support_session_messages=support_session_messages)
-    is_support_session_end = await check_support_session_end(chat=chat)
-    if is_support_session_end:
-        await crud.update_session_status(
-            session_id=support_session.id,
-            status=SupportStatus.end
-        )
-    else:
-        # установка таймера 30 мин для отправки уведомления клиенту
-        task = asyncio.create_task(schedule_followup(
-            chat_id=chat_id, business_connection_id=business_connection_id, support_session_id=support_session.id
-        ))
-        followup_tasks[chat_id] = task
     # Отправка ответа пользователю
-    await bot.send_message(
+    if streamer is not None:
+        await streamer.finish(answer)
+    else:
+        await bot.send_message(
+            chat_id=chat_id,
+            text=answer,
+            business_connection_id=business_connection_id
+        )
+    # напоминание клиенту через 30 мин, заменяет ранее запланированное
+    await followup_scheduler.schedule(
         chat_id=chat_id,
-        text=answer,
-        business_connection_id=business_connection_id
+        support_session_id=support_session.id,
+        business_connection_id=business_connection_id,
+        delay=FOLLOWUP_DELAY
     )
+    # Проверка на окончание диалога в фоне, после отправки ответа
+    session_history = await session_histories.get(support_session.id)
+    session_end_checker.submit(support_session=support_session, session_history=session_history)
+    history_summarizer.submit(session_history)
 
 
-async def handle_client_message(message: types.Message):
+async def handle_client_message(message: types.Message, created_at: datetime.datetime):
     """Обработчик сообщений от пользователя"""
     support_session = await get_or_create_support_session(str(message.chat.id))
     # отключение отправки сообщения через 30 минут от бота
-    task = followup_tasks.pop(str(message.chat.id), None)
-    if task:
-        task.cancel()
+    await followup_scheduler.cancel(str(message.chat.id))
+    # вердикт об окончании сессии, полученный до этого сообщения, больше не актуален
+    session_end_checker.cancel(support_session.id)
     # сохранение сообщения клиента в базе
     has_media_content_flag = False
     if has_media_content(message):
         print("Обнаружен медиа-контент, переключение на специалиста")
         has_media_content_flag  = True
         media_type, content = get_media_info(message)
-        await crud.add_message(
+        await session_histories.add_message(
             support_session_id=support_session.id,
             content=content,
             role=models.MessageRole.user,
-            type=media_type
+            type=media_type,
+            created_at=created_at
         )
     else:
         message_text = message.text or ""
-        await crud.add_message(
+        await session_histories.add_message(
             support_session_id=support_session.id,
             content=message_text,
             role=models.MessageRole.user,
-            type=MessageType.text
+            type=MessageType.text,
+            created_at=created_at
         )
     # выход, если сессию ведет оператор
     if support_session.assistant_type == AssistantType.human:
         print("Отвечает специалист, выход из функции")
+        message_coalescer.discard(str(message.chat.id))
         return
     # чтение сообщения клиента
     await bot(
@@ -193,22 +330,25 @@ async def handle_client_message(message: types.Message):
         )
     )
     # проверка на необходимость отправки сообщения-автоответчика
-    should_send_auto_reply_res = await should_send_auto_reply(session_id=support_session.id)
+    session_history = await session_histories.get(support_session.id)
+    should_send_auto_reply_res = await should_send_auto_reply(
+        session_id=support_session.id,
+        session_history=session_history
+    )
     if should_send_auto_reply_res:
         await bot.send_message(
             chat_id=str(message.chat.id),
             text=AUTO_REPLY,
             business_connection_id=message.business_connection_id
         )
-        await crud.add_message(
+        await session_histories.add_message(
             support_session_id=support_session.id,
             content=AUTO_REPLY,
             role=models.MessageRole.system
         )
-    session_messages = await crud.get_all_messages(support_session.id)
-    # получение и отправка сообщения клиенту
     if has_media_content_flag:
         print("Переключение на специалиста из-за наличия медиа-контента")
+        message_coalescer.discard(str(message.chat.id))
         await switch_to_human_specialist(
             support_session=support_session,
             chat_id=str(message.chat.id),
@@ -216,15 +356,64 @@ async def handle_client_message(message: types.Message):
             username=message.from_user.username
         )
         return
+    # ответ агента запускается после окна ожидания следующих сообщений клиента
+    message_coalescer.add(PendingMessages(
+        chat_id=str(message.chat.id),
+        support_session=support_session,
+        business_connection_id=message.business_connection_id,
+        username=message.from_user.username,
+        texts=[message_text]
+    ))
+
+
+async def answer_client_messages(pending_messages: PendingMessages):
+    """Ответить агентом на накопленные сообщения клиента"""
+    support_session = pending_messages.support_session
+    chat_id = pending_messages.chat_id
+    session_history = await session_histories.get(support_session.id)
+    if CHAT_LEASES:
+        # сообщения клиента могли прийти на разные реплики, и каждая объединила только свои.
+        # Под арендой история чата актуальна, поэтому ответ дается на все еще не отвеченные сообщения,
+        # а реплика, до которой очередь дошла позже, отвечать уже не будет
+        unanswered_messages = session_history.unanswered_user_messages()
+        if not unanswered_messages:
+            logger.info("Сообщения клиента чата %s уже обработаны другой репликой", chat_id)
+            return
+        pending_messages.texts = [message.content for message in unanswered_messages]
     print("Попытка ответить от бота")
-    answer, chat_history = await get_agent_answer(support_session_messages=session_messages, user_message=message_text)
+    streamer = MessageStreamer(
+        bot=bot,
+        chat_id=chat_id,
+        business_connection_id=pending_messages.business_connection_id
+    )
+
+    async def get_streamed_answer() -> tuple[str, str | None]:
+        await streamer.start()
+        try:
+            return await get_agent_answer(
+                session_history=session_history,
+                user_message=pending_messages.text,
+                pending_messages_count=len(pending_messages.texts),
+                streamer=streamer
+            )
+        except BaseException:
+            # заглушка не должна остаться в чате ни при отмене ответа, ни при ошибке агента
+            await streamer.discard()
+            raise
+
+    result = await message_coalescer.run_pipeline(pending_messages, get_streamed_answer)
+    if result is None:
+        print("Ответ отменен новым сообщением клиента")
+        return
+    answer, chat_history = result
     if answer == "need_human":
         print("Переключение диалога на специалиста")
         await switch_to_human_specialist(
             support_session=support_session,
-            chat_id=str(message.chat.id),
-            business_connection_id=message.business_connection_id,
-            username=message.from_user.username
+            chat_id=chat_id,
+            business_connection_id=pending_messages.business_connection_id,
+            username=pending_messages.username,
+            streamer=streamer
         )
         return
     else:
@@ -232,33 +421,101 @@ async def handle_client_message(message: types.Message):
         await process_agent_response(
             support_session=support_session,
             answer=answer,
-            chat_id=str(message.chat.id),
-            business_connection_id=message.business_connection_id
+            chat_id=chat_id,
+            business_connection_id=pending_messages.business_connection_id,
+            streamer=streamer
         )
 
 
-async def handle_specialist_message(message: types.Message):
+async def handle_specialist_message(message: types.Message, created_at: datetime.datetime):
     """Обработка сообщений от специалиста"""
     support_session = await crud.get_active_session(str(message.chat.id))
-    await crud.add_message(
+    await session_histories.add_message(
         support_session_id=support_session.id,
         content=message.text,
         role=models.MessageRole.assistant,
-        assistant_type=models.AssistantType.human
+        assistant_type=models.AssistantType.human,
+        created_at=created_at
     )
-    # Проверка на окончание диалога
-    support_session_messages = await crud.get_all_messages(support_session_id=support_session.id)
-    chat = create_chat(support_session_messages)
-    is_support_session_end = await check_support_session_end(chat=chat)
-    if is_support_session_end:
-        await crud.update_session_status(
-            session_id=support_session.id,
-            status=models.SupportStatus.end
+    # Проверка на окончание диалога в фоне
+    session_history = await session_histories.get(support_session.id)
+    session_end_checker.submit(support_session=support_session, session_history=session_history)
+
+
+@dp.startup()
+async def on_startup():
+    """Инициализация рантайма агента и воркеров до приема сообщений"""
+    get_agent()
+    message_journal.start()
+    chat_work_queue.start()
+    followup_scheduler.start()
+    if ACTIVE_SESSION_CACHE_SYNC:
+        await active_sessions.listen(listen_engine)
+    if CHAT_LEASES:
+        await chat_leases.listen(listen_engine)
+    background_tasks.append(asyncio.create_task(log_pool_metrics()))
+    background_tasks.append(asyncio.create_task(log_selection_metrics()))
+    if ARCHIVE_AFTER_DAYS:
+        background_tasks.append(asyncio.create_task(run_archiver(
+            older_than=datetime.timedelta(days=ARCHIVE_AFTER_DAYS),
+            interval=ARCHIVE_INTERVAL
+        )))
+    if BOT_MODE == "webhook" and WEBHOOK_URL:
+        # установка вебхука идемпотентна, ее может выполнять каждая реплика
+        await bot.set_webhook(
+            url=f"{WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}",
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=dp.resolve_used_update_types()
         )
 
 
+@dp.shutdown()
+async def on_shutdown():
+    """Обработка оставшихся сообщений и закрытие соединений рантайма агента"""
+    await followup_scheduler.stop()
+    await message_coalescer.flush()
+    await chat_work_queue.stop()
+    await session_end_checker.stop()
+    await history_summarizer.stop()
+    await message_journal.stop()
+    for task in background_tasks:
+        task.cancel()
+    await close_agent()
+    await active_sessions.stop_listening()
+    await chat_leases.stop_listening()
+    await engine.dispose()
+    if listen_engine is not None:
+        await listen_engine.dispose()
+
+
+async def run_webhook_server() -> None:
+    """Принимать обновления через вебхук до SIGTERM или SIGINT"""
+    app = web.Application()
+    SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=WEBHOOK_SECRET).register(app, path=WEBHOOK_PATH)
+    # startup и shutdown диспетчера выполняются при запуске и остановке приложения
+    setup_application(app, dp, bot=bot)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for stop_signal in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(stop_signal, stop_event.set)
+    await web.TCPSite(runner, host=WEB_SERVER_HOST, port=WEB_SERVER_PORT).start()
+    try:
+        await stop_event.wait()
+        logger.info("Получен сигнал остановки, завершение работы")
+    finally:
+        # сервер перестает принимать запросы, затем выполняется on_shutdown: запись журнала, освобождение аренд
+        await runner.cleanup()
+        for stop_signal in (signal.SIGTERM, signal.SIGINT):
+            loop.remove_signal_handler(stop_signal)
+
+
 async def main():
-    await dp.start_polling(bot)
+    if BOT_MODE == "webhook":
+        await run_webhook_server()
+    else:
+        await dp.start_polling(bot)
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO, stream=sys.stdout)
@@ -0,0 +1,106 @@
+import asyncio
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, TypeVar
+
+from telegram_bot.database.models import SupportSession
+
+T = TypeVar("T")
+
+
+@dataclass
+class PendingMessages:
+    """Сообщения клиента, на которые агент ответит одним запуском"""
+    chat_id: str
+    support_session: SupportSession
+    business_connection_id: str | None
+    username: str | None
+    texts: list[str] = field(default_factory=list)
+
+    @property
+    def text(self) -> str:
+        """Объединенный текст сообщений"""
+        return "\n".join(self.texts)
+
+
+class MessageCoalescer:
+    """Объединение идущих подряд сообщений клиента.
+
+    Сообщения, пришедшие в течение window секунд друг после друга, передаются агенту одним запросом.
+    Новое сообщение отменяет запущенный, но еще не завершенный ответ агента по этому чату,
+    его сообщения объединяются с новым.
+    """
+
+    def __init__(self, window: float, on_ready: Callable[[PendingMessages], Awaitable]):
+        self.window = window
+        self.on_ready = on_ready
+        self._pending: dict[str, PendingMessages] = {}
+        self._timers: dict[str, asyncio.Task] = {}
+        self._pipelines: dict[str, tuple[asyncio.Task, PendingMessages]] = {}
+
+    def interrupt(self, chat_id: str) -> None:
+        """Остановить таймер и отменить незавершенный ответ агента при поступлении нового сообщения"""
+        timer = self._timers.pop(chat_id, None)
+        if timer is not None:
+            timer.cancel()
+        pipeline = self._pipelines.get(chat_id)
+        if pipeline is not None:
+            pipeline[0].cancel()
+
+    def add(self, pending_messages: PendingMessages) -> None:
+        """Добавить сообщения клиента и перезапустить окно ожидания"""
+        chat_id = pending_messages.chat_id
+        pending = self._pending.get(chat_id)
+        if pending is None:
+            self._pending[chat_id] = pending_messages
+        else:
+            pending.texts.extend(pending_messages.texts)
+            pending.support_session = pending_messages.support_session
+            pending.business_connection_id = pending_messages.business_connection_id
+        self.interrupt(chat_id)
+        self._timers[chat_id] = asyncio.create_task(self._fire(chat_id))
+
+    def discard(self, chat_id: str) -> None:
+        """Забыть ожидающие сообщения чата, например, при переключении на специалиста"""
+        self.interrupt(chat_id)
+        self._pending.pop(chat_id, None)
+
+    async def flush(self) -> None:
+        """Сразу передать агенту все ожидающие сообщения, например, перед остановкой"""
+        for timer in self._timers.values():
+            timer.cancel()
+        self._timers.clear()
+        pending, self._pending = self._pending, {}
+        for pending_messages in pending.values():
+            await self.on_ready(pending_messages)
+
+    async def run_pipeline(self, pending_messages: PendingMessages, func: Callable[[], Awaitable[T]]) -> T | None:
+        """Выполнить отменяемую часть ответа агента. Возвращает None, если она была отменена новым сообщением"""
+        chat_id = pending_messages.chat_id
+        if chat_id in self._pending:
+            # пока задача ждала в очереди, пришли новые сообщения: ответим на все вместе
+            self._pending[chat_id].texts[:0] = pending_messages.texts
+            return None
+        task = asyncio.create_task(func())
+        self._pipelines[chat_id] = (task, pending_messages)
+        try:
+            return await task
+        except asyncio.CancelledError:
+            if not task.cancelled() or asyncio.current_task().cancelling():
+                raise
+            # возвращаем сообщения в ожидание, чтобы ответить на них вместе с новым
+            pending = self._pending.get(chat_id)
+            if pending is not None:
+                pending.texts[:0] = pending_messages.texts
+            else:
+                self._pending[chat_id] = pending_messages
+            return None
+        finally:
+            if self._pipelines.get(chat_id, (None,))[0] is task:
+                del self._pipelines[chat_id]
+
+    async def _fire(self, chat_id: str) -> None:
+        await asyncio.sleep(self.window)
+        self._timers.pop(chat_id, None)
+        pending_messages = self._pending.pop(chat_id, None)
+        if pending_messages is not None:
+            await self.on_ready(pending_messages)
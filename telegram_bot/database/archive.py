@@ -0,0 +1,84 @@
+import asyncio
+import argparse
+import datetime
+import logging
+
+from sqlalchemy import select, update, delete
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from telegram_bot.database.base import AsyncSessionLocal, engine
+from telegram_bot.database.models import SupportSession, SupportStatus, Message, MessageArchive
+
+logger = logging.getLogger(__name__)
+
+
+async def archive_closed_sessions(older_than: datetime.timedelta, batch_size: int = 100) -> int:
+    """Перенести в messages_archive сообщения сессий, завершенных раньше older_than назад.
+
+    Каждая пачка сессий переносится в своей транзакции, сессии, которые архивирует другой процесс, пропускаются.
+    Возвращает число заархивированных сессий.
+    """
+    cutoff = datetime.datetime.utcnow() - older_than
+    columns = [column.key for column in Message.__table__.columns]
+    archived = 0
+    while True:
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(
+                select(SupportSession.id)
+                .where(
+                    SupportSession.status == SupportStatus.end,
+                    SupportSession.closed_at < cutoff,
+                    SupportSession.archived_at.is_(None),
+                )
+                .order_by(SupportSession.closed_at)
+                .limit(batch_size)
+                .with_for_update(skip_locked=True)
+            )
+            session_ids = list(result.scalars().all())
+            if not session_ids:
+                break
+            await session.execute(
+                pg_insert(MessageArchive)
+                .from_select(columns, select(*Message.__table__.c).where(Message.support_session_id.in_(session_ids)))
+                .on_conflict_do_nothing(index_elements=[MessageArchive.id])
+            )
+            await session.execute(delete(Message).where(Message.support_session_id.in_(session_ids)))
+            await session.execute(
+                update(SupportSession)
+                .where(SupportSession.id.in_(session_ids))
+                .values(archived_at=datetime.datetime.utcnow())
+            )
+            await session.commit()
+        archived += len(session_ids)
+        if len(session_ids) < batch_size:
+            break
+    return archived
+
+
+async def run_archiver(older_than: datetime.timedelta, interval: float = 3600.0) -> None:
+    """Периодически архивировать сообщения давно завершенных сессий"""
+    while True:
+        try:
+            archived = await archive_closed_sessions(older_than=older_than)
+            if archived:
+                logger.info("Заархивированы сообщения %s сессий", archived)
+        except Exception:
+            logger.exception("Ошибка архивации сообщений")
+        await asyncio.sleep(interval)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Архивация сообщений завершенных сессий поддержки")
+    parser.add_argument("--days", type=float, default=30, help="Архивировать сессии, завершенные раньше, дней")
+    parser.add_argument("--batch-size", type=int, default=100)
+    args = parser.parse_args()
+    archived = await archive_closed_sessions(
+        older_than=datetime.timedelta(days=args.days),
+        batch_size=args.batch_size
+    )
+    print(f"Заархивировано сессий: {archived}")
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,14 +1,120 @@
-from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+import time
+import uuid
+import asyncio
+import logging
 
-from telegram_bot.database.config import DB_URL, DB_URL_TEST
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine, async_sessionmaker
 
-engine = create_async_engine(
+from telegram_bot.database.config import (
     DB_URL,
-    echo=True,
+    DB_URL_TEST,
+    DB_ECHO,
+    DB_POOL_SIZE,
+    DB_MAX_OVERFLOW,
+    DB_POOL_TIMEOUT,
+    DB_POOL_RECYCLE,
+    DB_POOL_PRE_PING,
+    DB_PREPARED_STATEMENT_CACHE_SIZE,
+    DB_PGBOUNCER,
+    DB_LISTEN_URL,
+    DB_SLOW_CHECKOUT,
 )
 
+logger = logging.getLogger(__name__)
+
+
+class InstrumentedPool(AsyncAdaptedQueuePool):
+    """Пул соединений со сбором метрик ожидания соединения"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.checkouts = 0
+        self.checkout_wait_total = 0.0
+        self.checkout_wait_max = 0.0
+        self.slow_checkouts = 0
+        self.checkout_timeouts = 0
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except Exception:
+            self.checkout_timeouts += 1
+            raise
+        finally:
+            wait = time.perf_counter() - started
+            self.checkouts += 1
+            self.checkout_wait_total += wait
+            self.checkout_wait_max = max(self.checkout_wait_max, wait)
+            if wait >= DB_SLOW_CHECKOUT:
+                self.slow_checkouts += 1
+                logger.warning("Ожидание соединения из пула %.3f с, занято %s", wait, self.checkedout())
+
+    def metrics(self) -> dict[str, float]:
+        """Метрики пула: занятые соединения и время ожидания соединения"""
+        return {
+            "size": self.size(),
+            "in_use": self.checkedout(),
+            "idle": self.checkedin(),
+            "overflow": max(self.overflow(), 0),
+            "checkouts": self.checkouts,
+            "checkout_wait_avg": self.checkout_wait_total / self.checkouts if self.checkouts else 0.0,
+            "checkout_wait_max": self.checkout_wait_max,
+            "slow_checkouts": self.slow_checkouts,
+            "checkout_errors": self.checkout_timeouts,
+        }
+
+
+def create_engine(url: str = DB_URL) -> AsyncEngine:
+    """Создать движок с настройками пула из переменных окружения"""
+    connect_args = {"prepared_statement_cache_size": DB_PREPARED_STATEMENT_CACHE_SIZE}
+    if DB_PGBOUNCER:
+        # PgBouncer в режиме transaction отдает разные серверные соединения,
+        # поэтому кеши подготовленных запросов отключаются, а имена делаются уникальными
+        connect_args = {
+            "prepared_statement_cache_size": 0,
+            "statement_cache_size": 0,
+            "prepared_statement_name_func": lambda: f"__asyncpg_{uuid.uuid4()}__",
+        }
+    return create_async_engine(
+        url,
+        echo=DB_ECHO,
+        poolclass=InstrumentedPool,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=DB_POOL_PRE_PING,
+        connect_args=connect_args,
+    )
+
+
+def create_listen_engine(url: str | None = DB_LISTEN_URL) -> AsyncEngine | None:
+    """Движок для соединений LISTEN напрямую к Postgres, минуя PgBouncer. None - прямое подключение не задано"""
+    if url is None:
+        return None
+    # соединения LISTEN держатся все время работы процесса, пул для них не нужен
+    return create_async_engine(url, echo=DB_ECHO, poolclass=NullPool)
+
+
+engine = create_engine()
+listen_engine = create_listen_engine()
+
 AsyncSessionLocal = async_sessionmaker(
     engine,
     expire_on_commit=False,
     autoflush=False,
 )
+
+
+def pool_metrics(_engine: AsyncEngine = engine) -> dict[str, float]:
+    """Метрики пула соединений движка"""
+    return _engine.pool.metrics()
+
+
+async def log_pool_metrics(interval: float = 60.0, _engine: AsyncEngine = engine) -> None:
+    """Периодически писать метрики пула в лог"""
+    while True:
+        await asyncio.sleep(interval)
+        logger.info("Пул соединений: %s", pool_metrics(_engine))
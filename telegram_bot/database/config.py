@@ -10,3 +10,20 @@ Base = declarative_base()
 DB_URL = f"postgresql+asyncpg://{os.getenv("DB_USER")}:{os.getenv("DB_PASSWORD")}@{os.getenv("DB_HOST")}:{os.getenv("DB_PORT")}/{os.getenv("DB_NAME")}"
 
 DB_URL_TEST = f"postgresql+asyncpg://{os.getenv('DB_USER_TEST')}@{os.getenv('DB_HOST_TEST')}:{os.getenv('DB_PORT_TEST')}/{os.getenv('DB_NAME_TEST')}"
+
+# настройки пула соединений
+DB_ECHO = os.getenv("DB_ECHO", "false").lower() == "true"  # логирование всех SQL-запросов
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 10))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 10))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 30))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+# размер кеша подготовленных запросов asyncpg на соединение
+DB_PREPARED_STATEMENT_CACHE_SIZE = int(os.getenv("DB_PREPARED_STATEMENT_CACHE_SIZE", 100))
+# подключение через PgBouncer в режиме transaction: подготовленные запросы не переиспользуются между транзакциями
+DB_PGBOUNCER = os.getenv("DB_PGBOUNCER", "false").lower() == "true"
+# прямое подключение к Postgres для LISTEN/NOTIFY: через PgBouncer в режиме transaction уведомления не доставляются,
+# поэтому при DB_PGBOUNCER без DB_LISTEN_URL подписки на уведомления отключены
+DB_LISTEN_URL = os.getenv("DB_LISTEN_URL") or (None if DB_PGBOUNCER else DB_URL)
+# время ожидания соединения из пула в секундах, после которого пишется предупреждение
+DB_SLOW_CHECKOUT = float(os.getenv("DB_SLOW_CHECKOUT", 0.1))
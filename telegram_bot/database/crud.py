@@ -1,11 +1,17 @@
 import uuid
-from typing import Optional
+import datetime
+from typing import Callable, Collection, Optional
 
-from sqlalchemy import select, asc
+from sqlalchemy import (
+    select, insert, update, delete, func, tuple_, cast, literal, union_all, text, String, Interval, TIMESTAMP, Table
+)
+from sqlalchemy.orm import aliased
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from telegram_bot.database.base import AsyncSessionLocal
+from telegram_bot.database.session_cache import active_sessions, notify_session_changed
 from telegram_bot.database.models import (
     Chat,
     SupportSession,
@@ -14,6 +20,9 @@ from telegram_bot.database.models import (
     MessageType,
     MessageRole,
     AssistantType,
+    ScheduledFollowup,
+    ChatLease,
+    MessageArchive,
 )
 
 
@@ -59,31 +68,41 @@ async def create_support_session(
     assistant_type: AssistantType = AssistantType.ai
 ) -> SupportSession:
     async with AsyncSessionLocal() as session:
-        # Выбираем максимальный номер сессии для данного чата
-        result = await session.execute(select(SupportSession.id).where(SupportSession.chat_id == chat_id))
-        existing_ids = [row[0] for row in result.all() if row[0].startswith(f'{chat_id}_')]
-        max_number = 0
-        for sid in existing_ids:
-            try:
-                n = int(sid.rsplit('_', 1)[-1])
-                max_number = max(max_number, n)
-            except Exception:
-                continue
-        next_number = max_number + 1
-        session_id = f"{chat_id}_{next_number}"
-        support_session = SupportSession(
-            id=session_id,
-            chat_id=chat_id,
-            status=SupportStatus.process,
-            assistant_type=assistant_type
+        # Номер сессии берется из счетчика чата: увеличение счетчика и создание сессии - один запрос
+        counter = (
+            update(Chat)
+            .where(Chat.id == chat_id)
+            .values(session_counter=Chat.session_counter + 1)
+            .returning(Chat.id, Chat.session_counter)
+            .cte("counter")
+        )
+        statement = (
+            insert(SupportSession)
+            .from_select(
+                ["id", "chat_id", "status", "assistant_type"],
+                select(
+                    counter.c.id + "_" + cast(counter.c.session_counter, String),
+                    counter.c.id,
+                    literal(SupportStatus.process, SupportSession.status.type),
+                    literal(assistant_type, SupportSession.assistant_type.type),
+                )
+            )
+            .returning(SupportSession)
         )
-        session.add(support_session)
+        result = await session.execute(select(SupportSession).from_statement(statement))
+        support_session = result.scalar_one_or_none()
+        if support_session is None:
+            raise ValueError(f"Чат {chat_id} не найден")
+        await notify_session_changed(session, chat_id)
         await session.commit()
-        await session.refresh(support_session)
+        active_sessions.put(support_session)
         return support_session
 
 
 async def get_active_session(chat_id: str) -> Optional[SupportSession]:
+    support_session = active_sessions.get(chat_id)
+    if support_session is not None:
+        return support_session
     async with AsyncSessionLocal() as session:
         result = await session.execute(
             select(SupportSession)
@@ -92,32 +111,63 @@ async def get_active_session(chat_id: str) -> Optional[SupportSession]:
                 SupportSession.status == SupportStatus.process,
             )
             .order_by(SupportSession.created_at.desc())
+            .limit(1)
         )
-        return result.scalars().first()
+        support_session = result.scalars().first()
+    if support_session is not None:
+        active_sessions.put(support_session)
+    return support_session
 
 
-async def update_session_status(session_id: str, *, status: SupportStatus) -> Optional[SupportSession]:
+async def _update_session(session_id: str, **values) -> Optional[SupportSession]:
+    """Обновить сессию одним запросом и синхронизировать кеш активных сессий"""
     async with AsyncSessionLocal() as session:
-        result = await session.execute(select(SupportSession).where(SupportSession.id == session_id))
+        statement = (
+            update(SupportSession)
+            .where(SupportSession.id == session_id)
+            .values(**values)
+            .returning(SupportSession)
+        )
+        result = await session.execute(
+            select(SupportSession).from_statement(statement).execution_options(populate_existing=True)
+        )
         support_session = result.scalar_one_or_none()
         if support_session is None:
             return None
-        support_session.status = status
+        await notify_session_changed(session, support_session.chat_id)
         await session.commit()
-        await session.refresh(support_session)
-        return support_session
+    active_sessions.put(support_session)
+    return support_session
+
+
+async def update_session_status(session_id: str, *, status: SupportStatus) -> Optional[SupportSession]:
+    closed_at = datetime.datetime.utcnow() if status == SupportStatus.end else None
+    return await _update_session(session_id, status=status, closed_at=closed_at)
 
 
 async def update_session_assistant_type(session_id: str, *, assistant_type: AssistantType) -> Optional[SupportSession]:
+    return await _update_session(session_id, assistant_type=assistant_type)
+
+
+async def get_history_summary(session_id: str) -> tuple[Optional[str], int]:
+    """Краткое содержание ранних сообщений сессии и число сообщений, вошедших в него"""
     async with AsyncSessionLocal() as session:
-        result = await session.execute(select(SupportSession).where(SupportSession.id == session_id))
-        support_session = result.scalar_one_or_none()
-        if support_session is None:
-            return None
-        support_session.assistant_type = assistant_type 
+        result = await session.execute(
+            select(SupportSession.history_summary, SupportSession.history_summarized_count)
+            .where(SupportSession.id == session_id)
+        )
+        row = result.one_or_none()
+        return (row[0], row[1]) if row is not None else (None, 0)
+
+
+async def update_history_summary(session_id: str, *, summary: str, summarized_count: int) -> None:
+    async with AsyncSessionLocal() as session:
+        await session.execute(
+            update(SupportSession)
+            .where(SupportSession.id == session_id)
+            .values(history_summary=summary, history_summarized_count=summarized_count)
+        )
         await session.commit()
-        await session.refresh(support_session)
-        return support_session
 
 
 async def add_message(
@@ -128,10 +178,8 @@ async def add_message(
     assistant_type: AssistantType | None = None,
     type: MessageType = MessageType.text
 ) -> Message:
-    import datetime
-
     async with AsyncSessionLocal() as session:
-        now_iso = datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S')
+        now = datetime.datetime.utcnow()
         message = Message(
             id=str(uuid.uuid4()),
             support_session_id=support_session_id,
@@ -139,7 +187,8 @@ async def add_message(
             type=type,
             role=role,
             assistant_type=assistant_type,
-            created_at_str=now_iso,
+            created_at=now,
+            created_at_str=now.strftime('%Y-%m-%dT%H:%M:%S'),
         )
         session.add(message)
         await session.commit()
@@ -147,16 +196,121 @@ async def add_message(
         return message
 
 
+async def add_messages(messages: list[Message]) -> None:
+    """Сохранить несколько сообщений одним многострочным INSERT в одной транзакции"""
+    if not messages:
+        return
+    columns = [column.key for column in Message.__table__.columns]
+    async with AsyncSessionLocal() as session:
+        await session.execute(
+            insert(Message),
+            [{column: getattr(message, column) for column in columns} for message in messages]
+        )
+        await session.commit()
+
+
+def messages_with_archive(
+    where: Callable[[Table], list] = lambda table: [],
+    order_by: Callable[[Table], list] | None = None,
+    limit: int | None = None
+) -> type[Message]:
+    """Сообщения из messages и messages_archive как одна сущность Message.
+
+    Условия, сортировка и лимит применяются к каждой таблице отдельно, чтобы использовались их индексы.
+    """
+    branches = []
+    for table in (Message.__table__, MessageArchive.__table__):
+        branch = select(*table.c).where(*where(table))
+        if order_by is not None:
+            branch = branch.order_by(*order_by(table))
+        if limit is not None:
+            branch = branch.limit(limit)
+        branches.append(branch)
+    return aliased(Message, union_all(*branches).subquery("all_messages"))
+
+
 async def get_all_messages(support_session_id: str) -> list[Message]:
+    messages = messages_with_archive(where=lambda table: [table.c.support_session_id == support_session_id])
     async with AsyncSessionLocal() as session:
         result = await session.execute(
-            select(Message)
-            .where(Message.support_session_id == support_session_id)
-            .order_by(asc(Message.created_at_str))  # сортировка по времени
+            select(messages).order_by(messages.created_at, messages.id)  # сортировка по времени
         )
         return list(result.scalars().all())
 
 
+def _last_messages_query(
+    support_session_id: str,
+    limit: int,
+    before: tuple[datetime.datetime, str] | None = None
+):
+    def where(table: Table) -> list:
+        conditions = [table.c.support_session_id == support_session_id]
+        if before is not None:
+            conditions.append(tuple_(table.c.created_at, table.c.id) < tuple_(*before))
+        return conditions
+
+    messages = messages_with_archive(
+        where=where,
+        order_by=lambda table: [table.c.created_at.desc(), table.c.id.desc()],
+        limit=limit
+    )
+    return select(messages).order_by(messages.created_at.desc(), messages.id.desc()).limit(limit)
+
+
+def _count_messages_query(
+    support_session_id: str,
+    role: MessageRole | None = None,
+    exclude_ids: Collection[str] = ()
+):
+    def where(table: Table) -> list:
+        conditions = [table.c.support_session_id == support_session_id]
+        if role is not None:
+            conditions.append(table.c.role == role)
+        if exclude_ids:
+            conditions.append(table.c.id.notin_(list(exclude_ids)))
+        return conditions
+
+    return select(func.count()).select_from(messages_with_archive(where=where))
+
+
+async def get_last_messages(
+    support_session_id: str,
+    limit: int = 50,
+    before: tuple[datetime.datetime, str] | None = None
+) -> list[Message]:
+    """Последние limit сообщений сессии в порядке времени.
+
+    Для чтения более ранней страницы передается before = (created_at, id) первого сообщения текущей страницы.
+    """
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(_last_messages_query(support_session_id, limit=limit, before=before))
+        return list(reversed(result.scalars().all()))
+
+
+async def count_messages(
+    support_session_id: str,
+    role: MessageRole | None = None,
+    exclude_ids: Collection[str] = ()
+) -> int:
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(_count_messages_query(support_session_id, role=role, exclude_ids=exclude_ids))
+        return result.scalar_one()
+
+
+async def get_message_tail(support_session_id: str, skip: int) -> tuple[int, list[Message]]:
+    """Число сообщений сессии и сообщения после первых skip в порядке времени.
+
+    Оба запроса выполняются в одном снимке базы, чтобы сообщение, записанное между ними, не сдвинуло границу.
+    """
+    async with AsyncSessionLocal() as session:
+        await session.connection(execution_options={"isolation_level": "REPEATABLE READ"})
+        total = (await session.execute(_count_messages_query(support_session_id))).scalar_one()
+        if total <= skip:
+            return total, []
+        result = await session.execute(_last_messages_query(support_session_id, limit=total - skip))
+        return total, list(reversed(result.scalars().all()))
+
+
 async def update_message_content(message_id: str, new_content: str) -> Optional[Message]:
     async with AsyncSessionLocal() as session:
         result = await session.execute(select(Message).where(Message.id == message_id))
@@ -180,3 +334,145 @@ async def delete_message(message_id: str) -> bool:
         return True
 
 
+async def schedule_followup(
+    chat_id: str,
+    support_session_id: str,
+    business_connection_id: str | None,
+    due_at: datetime.datetime
+) -> None:
+    """Запланировать напоминание чату, заменив ранее запланированное"""
+    async with AsyncSessionLocal() as session:
+        statement = pg_insert(ScheduledFollowup).values(
+            chat_id=chat_id,
+            support_session_id=support_session_id,
+            business_connection_id=business_connection_id,
+            due_at=due_at,
+        )
+        await session.execute(statement.on_conflict_do_update(
+            index_elements=[ScheduledFollowup.chat_id],
+            set_={
+                "support_session_id": statement.excluded.support_session_id,
+                "business_connection_id": statement.excluded.business_connection_id,
+                "due_at": statement.excluded.due_at,
+                "claimed_by": None,
+                "claimed_until": None,
+            }
+        ))
+        await session.commit()
+
+
+async def cancel_followup(chat_id: str) -> bool:
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(delete(ScheduledFollowup).where(ScheduledFollowup.chat_id == chat_id))
+        await session.commit()
+        return result.rowcount > 0
+
+
+async def claim_due_followups(
+    now: datetime.datetime,
+    owner: str,
+    ttl: float,
+    limit: int = 100
+) -> list[ScheduledFollowup]:
+    """Захватить наступившие напоминания на ttl секунд. Строка удаляется только после отправки напоминания,
+    захват, истекший без отправки, например, из-за остановки реплики, позволяет забрать напоминание снова.
+    Строки, которые сейчас захватывает другой процесс, пропускаются"""
+    async with AsyncSessionLocal() as session:
+        due = (
+            select(ScheduledFollowup.chat_id)
+            .where(
+                ScheduledFollowup.due_at <= now,
+                (ScheduledFollowup.claimed_until.is_(None)) | (ScheduledFollowup.claimed_until < _db_utcnow())
+            )
+            .order_by(ScheduledFollowup.due_at)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+        )
+        statement = (
+            update(ScheduledFollowup)
+            .where(ScheduledFollowup.chat_id.in_(due.scalar_subquery()))
+            .values(claimed_by=owner, claimed_until=_db_utcnow() + _seconds(ttl))
+            .returning(ScheduledFollowup)
+        )
+        result = await session.execute(select(ScheduledFollowup).from_statement(statement))
+        followups = list(result.scalars().all())
+        await session.commit()
+        return followups
+
+
+async def complete_followup(chat_id: str, due_at: datetime.datetime) -> bool:
+    """Удалить отправленное напоминание. Перенесенное за время отправки напоминание остается"""
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(
+            delete(ScheduledFollowup).where(ScheduledFollowup.chat_id == chat_id, ScheduledFollowup.due_at == due_at)
+        )
+        await session.commit()
+        return result.rowcount > 0
+
+
+async def get_next_followup_due() -> Optional[datetime.datetime]:
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(select(func.min(ScheduledFollowup.due_at)))
+        return result.scalar_one_or_none()
+
+
+def _db_utcnow():
+    # время базы, общее для всех реплик
+    return func.timezone("utc", func.now(), type_=TIMESTAMP)
+
+
+def _seconds(seconds: float):
+    return cast(literal(datetime.timedelta(seconds=seconds), Interval()), Interval)
+
+
+# канал Postgres, в который отправляется id освобожденного чата
+LEASE_RELEASE_CHANNEL = "chat_lease_released"
+
+
+async def acquire_chat_lease(chat_id: str, owner: str, ttl: float) -> tuple[bool, Optional[str]]:
+    """Взять аренду чата, если она свободна или истекла. Возвращает признак успеха и прошлого владельца"""
+    async with AsyncSessionLocal() as session:
+        previous_owner = select(ChatLease.owner).where(ChatLease.chat_id == chat_id).scalar_subquery()
+        statement = pg_insert(ChatLease).values(
+            chat_id=chat_id,
+            owner=owner,
+            expires_at=_db_utcnow() + _seconds(ttl),
+        )
+        statement = statement.on_conflict_do_update(
+            index_elements=[ChatLease.chat_id],
+            set_={"owner": statement.excluded.owner, "expires_at": statement.excluded.expires_at},
+            where=(ChatLease.expires_at < _db_utcnow()) | (ChatLease.owner == owner)
+        ).returning(previous_owner)  # подзапрос видит состояние до изменения
+        result = await session.execute(statement)
+        row = result.one_or_none()
+        await session.commit()
+        if row is None:
+            return False, None
+        return True, row[0]
+
+
+async def renew_chat_lease(chat_id: str, owner: str, ttl: float) -> bool:
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(
+            update(ChatLease)
+            .where(ChatLease.chat_id == chat_id, ChatLease.owner == owner)
+            .values(expires_at=_db_utcnow() + _seconds(ttl))
+        )
+        await session.commit()
+        return result.rowcount > 0
+
+
+async def release_chat_lease(chat_id: str, owner: str) -> None:
+    """Освободить аренду чата и уведомить ждущие ее реплики. Строка остается, чтобы следующий владелец знал прошлого"""
+    async with AsyncSessionLocal() as session:
+        await session.execute(
+            update(ChatLease)
+            .where(ChatLease.chat_id == chat_id, ChatLease.owner == owner)
+            .values(expires_at=_db_utcnow())
+        )
+        # уведомление доставляется после фиксации транзакции
+        await session.execute(
+            text("SELECT pg_notify(:channel, :payload)"),
+            {"channel": LEASE_RELEASE_CHANNEL, "payload": chat_id}
+        )
+        await session.commit()
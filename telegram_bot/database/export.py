@@ -0,0 +1,223 @@
+import os
+import enum
+import json
+import asyncio
+import argparse
+import datetime
+from typing import AsyncIterator
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from telegram_bot.database.base import engine
+from telegram_bot.database.crud import messages_with_archive
+from telegram_bot.database.models import SupportSession, SupportStatus
+
+# на сколько отстает верхняя граница инкрементальной выгрузки: сообщения записываются в базу с задержкой
+WATERMARK_LAG = datetime.timedelta(minutes=5)
+
+SESSION_COLUMNS = (
+    SupportSession.id, SupportSession.chat_id, SupportSession.status, SupportSession.assistant_type,
+    SupportSession.created_at, SupportSession.closed_at
+)
+MESSAGE_COLUMNS = ("id", "role", "assistant_type", "type", "content", "created_at")
+
+
+def _value(value):
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    if isinstance(value, enum.Enum):
+        return value.value
+    return value
+
+
+async def stream_sessions(
+    _engine: AsyncEngine = engine,
+    status: SupportStatus | None = None,
+    created_from: datetime.datetime | None = None,
+    created_to: datetime.datetime | None = None,
+    messages_after: datetime.datetime | None = None,
+    messages_until: datetime.datetime | None = None,
+    batch_size: int = 1000
+) -> AsyncIterator[dict]:
+    """Сессии поддержки с сообщениями по одной, без загрузки всей выборки в память.
+
+    Строки читаются серверным курсором в read-only транзакции с одним снимком данных, блокировки записи
+    не берутся. При messages_after выгружаются только сессии с сообщениями новее этого времени.
+    """
+    # сообщения читаются и из архива
+    Message = messages_with_archive()
+    conditions = []
+    if status is not None:
+        conditions.append(SupportSession.status == status)
+    if created_from is not None:
+        conditions.append(SupportSession.created_at >= created_from)
+    if created_to is not None:
+        conditions.append(SupportSession.created_at < created_to)
+    if messages_until is not None:
+        conditions.append(Message.created_at <= messages_until)
+    if messages_after is not None:
+        changed_sessions = select(Message.support_session_id).where(Message.created_at > messages_after)
+        if messages_until is not None:
+            changed_sessions = changed_sessions.where(Message.created_at <= messages_until)
+        conditions.append(SupportSession.id.in_(changed_sessions))
+    query = (
+        select(*SESSION_COLUMNS, *[getattr(Message, column).label(f"message_{column}") for column in MESSAGE_COLUMNS])
+        .join(Message, Message.support_session_id == SupportSession.id)
+        .where(*conditions)
+        .order_by(SupportSession.id, Message.created_at, Message.id)
+        .execution_options(yield_per=batch_size)
+    )
+    async with _engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="REPEATABLE READ", postgresql_readonly=True)
+        async with conn.begin():
+            result = await conn.stream(query)
+            session = None
+            async for row in result:
+                if session is None or session["id"] != row.id:
+                    if session is not None:
+                        yield session
+                    session = {column.key: _value(getattr(row, column.key)) for column in SESSION_COLUMNS}
+                    session["messages"] = []
+                session["messages"].append({
+                    column: _value(getattr(row, f"message_{column}")) for column in MESSAGE_COLUMNS
+                })
+            if session is not None:
+                yield session
+
+
+class JSONLWriter:
+    """Запись сессий в JSONL: одна сессия на строку"""
+
+    def __init__(self, path: str):
+        self.file = open(path, "w", encoding="utf-8")
+
+    def write(self, session: dict) -> None:
+        self.file.write(json.dumps(session, ensure_ascii=False))
+        self.file.write("\n")
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class ParquetWriter:
+    """Запись сессий в Parquet группами строк по row_group_size сессий. Требует pyarrow"""
+
+    def __init__(self, path: str, row_group_size: int = 1000):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise RuntimeError("Для выгрузки в Parquet установите pyarrow") from e
+        self.pa = pa
+        message_type = pa.struct([
+            ("id", pa.string()), ("role", pa.string()), ("assistant_type", pa.string()),
+            ("type", pa.string()), ("content", pa.string()), ("created_at", pa.string()),
+        ])
+        self.schema = pa.schema([
+            ("id", pa.string()), ("chat_id", pa.string()), ("status", pa.string()),
+            ("assistant_type", pa.string()), ("created_at", pa.string()), ("closed_at", pa.string()),
+            ("messages", pa.list_(message_type)),
+        ])
+        self.writer = pq.ParquetWriter(path, self.schema, compression="zstd")
+        self.row_group_size = row_group_size
+        self.rows: list[dict] = []
+
+    def write(self, session: dict) -> None:
+        self.rows.append(session)
+        if len(self.rows) >= self.row_group_size:
+            self._flush()
+
+    def close(self) -> None:
+        self._flush()
+        self.writer.close()
+
+    def _flush(self) -> None:
+        if self.rows:
+            self.writer.write_table(self.pa.Table.from_pylist(self.rows, schema=self.schema))
+            self.rows = []
+
+
+def read_watermark(path: str) -> datetime.datetime | None:
+    """Время, до которого сообщения уже выгружены"""
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return datetime.datetime.fromisoformat(json.load(f)["messages_until"])
+
+
+def write_watermark(path: str, messages_until: datetime.datetime) -> None:
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"messages_until": messages_until.isoformat()}, f)
+    os.replace(tmp_path, path)
+
+
+async def export_sessions(
+    output: str,
+    format: str = "jsonl",
+    status: SupportStatus | None = None,
+    created_from: datetime.datetime | None = None,
+    created_to: datetime.datetime | None = None,
+    watermark_path: str | None = None,
+    batch_size: int = 1000
+) -> int:
+    """Выгрузить сессии поддержки с сообщениями в файл. Возвращает число выгруженных сессий.
+
+    С watermark_path выгружаются только сессии, в которых появились сообщения после прошлой выгрузки,
+    сессия выгружается целиком. Файл с отметкой обновляется только после успешной выгрузки.
+    """
+    messages_after = read_watermark(watermark_path) if watermark_path else None
+    messages_until = datetime.datetime.utcnow() - WATERMARK_LAG if watermark_path else None
+    tmp_output = f"{output}.tmp"
+    writer = ParquetWriter(tmp_output, row_group_size=batch_size) if format == "parquet" else JSONLWriter(tmp_output)
+    count = 0
+    try:
+        async for session in stream_sessions(
+            status=status,
+            created_from=created_from,
+            created_to=created_to,
+            messages_after=messages_after,
+            messages_until=messages_until,
+            batch_size=batch_size
+        ):
+            writer.write(session)
+            count += 1
+    except BaseException:
+        writer.close()
+        os.remove(tmp_output)
+        raise
+    writer.close()
+    os.replace(tmp_output, output)
+    if watermark_path:
+        write_watermark(watermark_path, messages_until)
+    return count
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Выгрузка сессий поддержки с сообщениями")
+    parser.add_argument("output", help="Путь к файлу выгрузки")
+    parser.add_argument("--format", choices=["jsonl", "parquet"], default="jsonl")
+    parser.add_argument("--status", choices=[status.value for status in SupportStatus])
+    parser.add_argument("--from", dest="created_from", type=datetime.datetime.fromisoformat,
+                        help="Сессии, созданные начиная с даты (UTC)")
+    parser.add_argument("--to", dest="created_to", type=datetime.datetime.fromisoformat,
+                        help="Сессии, созданные до даты (UTC)")
+    parser.add_argument("--watermark", help="Файл с отметкой прошлой выгрузки для инкрементальной выгрузки")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+    count = await export_sessions(
+        output=args.output,
+        format=args.format,
+        status=SupportStatus(args.status) if args.status else None,
+        created_from=args.created_from,
+        created_to=args.created_to,
+        watermark_path=args.watermark,
+        batch_size=args.batch_size
+    )
+    print(f"Выгружено сессий: {count}")
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
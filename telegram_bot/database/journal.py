@@ -0,0 +1,200 @@
+import os
+import uuid
+import asyncio
+import logging
+import datetime
+
+from sqlalchemy.exc import DataError, DBAPIError, IntegrityError, StatementError
+
+from telegram_bot.database import crud
+from telegram_bot.database.models import Message, MessageType, MessageRole, AssistantType
+
+logger = logging.getLogger(__name__)
+
+
+def is_data_error(error: BaseException) -> bool:
+    """Ошибка в самих записываемых строках: повторная запись тех же данных ее не исправит"""
+    if isinstance(error, (IntegrityError, DataError)):
+        return True
+    # ошибки подготовки параметров на стороне SQLAlchemy, до обращения к базе
+    return isinstance(error, StatementError) and not isinstance(error, DBAPIError)
+
+
+class MessageJournal:
+    """Буфер записи сообщений в базу.
+
+    Сообщение принимается сразу и остается видимым через pending до записи в базу.
+    Накопленные сообщения сохраняются пачкой раз в flush_interval секунд или при накоплении max_batch_size.
+    При временной ошибке записи сообщения остаются в буфере, повторы идут с растущей паузой до max_retry_delay.
+    После max_retries неудачных попыток подряд пачка отбрасывается. Если ошибка в данных, пачка делится пополам
+    до отдельных сообщений, отбрасываются только сообщения, которые не удается записать.
+    """
+
+    def __init__(
+        self,
+        flush_interval: float = 0.5,
+        max_batch_size: int = 100,
+        max_retries: int = 10,
+        max_retry_delay: float = 30.0
+    ):
+        self.flush_interval = flush_interval
+        self.max_batch_size = max_batch_size
+        self.max_retries = max_retries
+        self.max_retry_delay = max_retry_delay
+        self.failures = 0
+        self.dropped = 0
+        self._buffer: list[Message] = []
+        self._in_flight: list[Message] = []
+        self._flush_lock = asyncio.Lock()
+        self._batch_ready = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self._stopping = False
+
+    def start(self) -> None:
+        """Запустить фоновую запись"""
+        if self._task is None:
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Остановить фоновую запись и сохранить все накопленные сообщения"""
+        if self._task is not None:
+            # запись не прерывается отменой, чтобы не повторить уже сохраненную пачку
+            self._stopping = True
+            self._batch_ready.set()
+            await self._task
+            self._task = None
+        try:
+            await self.flush()
+        except Exception:
+            logger.exception("Не удалось сохранить %s сообщений при остановке", len(self._buffer))
+
+    def add(
+        self,
+        support_session_id: str,
+        content: str,
+        *,
+        role: MessageRole,
+        assistant_type: AssistantType | None = None,
+        type: MessageType = MessageType.text,
+        created_at: datetime.datetime | None = None
+    ) -> Message:
+        """Принять сообщение к записи. Возвращает сообщение, которое будет сохранено в базе.
+        created_at - время сообщения в UTC, по умолчанию текущее"""
+        now = created_at or datetime.datetime.utcnow()
+        message = Message(
+            id=str(uuid.uuid4()),
+            support_session_id=support_session_id,
+            content=content,
+            type=type,
+            role=role,
+            assistant_type=assistant_type,
+            created_at=now,
+            created_at_str=now.strftime('%Y-%m-%dT%H:%M:%S'),
+        )
+        self._buffer.append(message)
+        if len(self._buffer) >= self.max_batch_size:
+            self._batch_ready.set()
+        return message
+
+    def pending(self, support_session_id: str) -> list[Message]:
+        """Еще не записанные в базу сообщения сессии в порядке добавления"""
+        return [
+            message for message in [*self._in_flight, *self._buffer]
+            if message.support_session_id == support_session_id
+        ]
+
+    async def flush(self, chat_id: str | None = None) -> None:
+        """Записать накопленные сообщения в базу. С chat_id - только сообщения сессий этого чата,
+        остальные продолжают копиться до общей записи пачкой"""
+        async with self._flush_lock:
+            while True:
+                self._in_flight = self._take_batch(chat_id)
+                if not self._in_flight:
+                    break
+                try:
+                    await self._write(list(self._in_flight))
+                except Exception:
+                    self.failures += 1
+                    if self.failures < self.max_retries:
+                        raise
+                    logger.exception(
+                        "Запись не удалась %s раз подряд, %s сообщений отброшено", self.failures, len(self._in_flight)
+                    )
+                    self.dropped += len(self._in_flight)
+                    self._in_flight = []
+                    self.failures = 0
+                else:
+                    self.failures = 0
+                finally:
+                    # в буфер возвращаются только не записанные и не отброшенные сообщения
+                    self._buffer[:0] = self._in_flight
+                    self._in_flight = []
+
+    def _take_batch(self, chat_id: str | None) -> list[Message]:
+        if chat_id is None:
+            batch = self._buffer[:self.max_batch_size]
+            del self._buffer[:len(batch)]
+            return batch
+        # id сессии начинается с id чата
+        prefix = f"{chat_id}_"
+        batch = [message for message in self._buffer if message.support_session_id.startswith(prefix)]
+        batch = batch[:self.max_batch_size]
+        taken_ids = {message.id for message in batch}
+        self._buffer = [message for message in self._buffer if message.id not in taken_ids]
+        return batch
+
+    async def _write(self, messages: list[Message]) -> None:
+        try:
+            await crud.add_messages(messages)
+        except Exception as e:
+            if not is_data_error(e):
+                raise
+            if len(messages) == 1:
+                logger.exception("Сообщение %s не может быть записано и отброшено", messages[0].id)
+                self.dropped += 1
+            else:
+                middle = len(messages) // 2
+                await self._write(messages[:middle])
+                await self._write(messages[middle:])
+                return
+        written_ids = {message.id for message in messages}
+        self._in_flight = [message for message in self._in_flight if message.id not in written_ids]
+
+    async def _wait(self, timeout: float, until_stop: bool = False) -> None:
+        """Подождать timeout секунд или накопления пачки. С until_stop пачка ожидание не прерывает, только остановка"""
+        deadline = asyncio.get_running_loop().time() + timeout
+        while not self._stopping:
+            remaining = deadline - asyncio.get_running_loop().time()
+            if remaining <= 0:
+                return
+            try:
+                await asyncio.wait_for(self._batch_ready.wait(), timeout=remaining)
+            except asyncio.TimeoutError:
+                return
+            finally:
+                self._batch_ready.clear()
+            if not until_stop:
+                return
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            if self.failures:
+                # после ошибки следующая попытка откладывается, новые сообщения ее не ускоряют
+                await self._wait(min(self.flush_interval * 2 ** self.failures, self.max_retry_delay), until_stop=True)
+            else:
+                await self._wait(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception(
+                    "Ошибка записи сообщений (попытка %s), %s сообщений будут записаны повторно",
+                    self.failures, len(self._buffer)
+                )
+
+
+message_journal = MessageJournal(
+    flush_interval=float(os.getenv("MESSAGE_FLUSH_INTERVAL", 0.5)),
+    max_batch_size=int(os.getenv("MESSAGE_FLUSH_BATCH_SIZE", 100)),
+    max_retries=int(os.getenv("MESSAGE_FLUSH_MAX_RETRIES", 10))
+)
@@ -0,0 +1,118 @@
+import asyncio
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from telegram_bot.database.base import engine
+
+# Миграции схемы для уже существующих баз: (версия, описание, SQL-запросы).
+# Новые базы создаются сразу по моделям в init_db, запросы миграций должны быть идемпотентными.
+MIGRATIONS: list[tuple[int, str, list[str]]] = [
+    (
+        1,
+        "Время сообщения в TIMESTAMP и индексы для частых запросов",
+        [
+            "ALTER TABLE messages ADD COLUMN IF NOT EXISTS created_at TIMESTAMP",
+            """
+            UPDATE messages SET created_at = created_at_str::timestamp
+            WHERE created_at IS NULL AND created_at_str IS NOT NULL
+            """,
+            "UPDATE messages SET created_at = 'epoch'::timestamp WHERE created_at IS NULL",
+            "ALTER TABLE messages ALTER COLUMN created_at SET DEFAULT (now() at time zone 'utc')",
+            "ALTER TABLE messages ALTER COLUMN created_at SET NOT NULL",
+            """
+            CREATE INDEX IF NOT EXISTS ix_messages_session_created
+            ON messages (support_session_id, created_at, id)
+            """,
+            """
+            CREATE INDEX IF NOT EXISTS ix_support_session_chat_status_created
+            ON support_session (chat_id, status, created_at)
+            """,
+        ]
+    ),
+    (
+        2,
+        "Счетчик сессий чата",
+        [
+            "ALTER TABLE chats ADD COLUMN IF NOT EXISTS session_counter INTEGER NOT NULL DEFAULT 0",
+            r"""
+            UPDATE chats SET session_counter = numbers.max_number
+            FROM (
+                SELECT chat_id, max((regexp_match(id, '_(\d+)$'))[1]::integer) AS max_number
+                FROM support_session
+                WHERE starts_with(id, chat_id || '_')
+                GROUP BY chat_id
+            ) AS numbers
+            WHERE numbers.chat_id = chats.id AND numbers.max_number > chats.session_counter
+            """,
+        ]
+    ),
+    (
+        3,
+        "Время завершения сессий и архивация сообщений",
+        [
+            "ALTER TABLE support_session ADD COLUMN IF NOT EXISTS archived_at TIMESTAMP",
+            """
+            UPDATE support_session SET closed_at = COALESCE(
+                (SELECT max(created_at) FROM messages WHERE messages.support_session_id = support_session.id),
+                support_session.created_at
+            )
+            WHERE status = 'end' AND closed_at IS NULL
+            """,
+            """
+            CREATE INDEX IF NOT EXISTS ix_support_session_status_closed
+            ON support_session (status, closed_at)
+            """,
+        ]
+    ),
+    (
+        4,
+        "Краткое содержание истории сессии",
+        [
+            "ALTER TABLE support_session ADD COLUMN IF NOT EXISTS history_summary TEXT",
+            "ALTER TABLE support_session ADD COLUMN IF NOT EXISTS history_summarized_count INTEGER NOT NULL DEFAULT 0",
+        ]
+    ),
+    (
+        5,
+        "Захват напоминаний до их отправки",
+        [
+            "ALTER TABLE scheduled_followups ADD COLUMN IF NOT EXISTS claimed_by VARCHAR",
+            "ALTER TABLE scheduled_followups ADD COLUMN IF NOT EXISTS claimed_until TIMESTAMP",
+        ]
+    ),
+]
+
+
+async def run_migrations(_engine: AsyncEngine = engine) -> list[int]:
+    """Применить недостающие миграции, каждую в своей транзакции. Возвращает версии примененных миграций"""
+    async with _engine.begin() as conn:
+        await conn.execute(text(
+            "CREATE TABLE IF NOT EXISTS schema_migrations "
+            "(version INTEGER PRIMARY KEY, applied_at TIMESTAMP NOT NULL DEFAULT now())"
+        ))
+        result = await conn.execute(text("SELECT version FROM schema_migrations"))
+        applied_versions = {row[0] for row in result}
+
+    applied = []
+    for version, description, statements in MIGRATIONS:
+        if version in applied_versions:
+            continue
+        async with _engine.begin() as conn:
+            # защита от одновременного запуска миграций несколькими процессами
+            await conn.execute(text("SELECT pg_advisory_xact_lock(hashtext('schema_migrations'))"))
+            exists = await conn.execute(
+                text("SELECT 1 FROM schema_migrations WHERE version = :version"), {"version": version}
+            )
+            if exists.scalar_one_or_none() is not None:
+                continue
+            for statement in statements:
+                await conn.execute(text(statement))
+            await conn.execute(text("INSERT INTO schema_migrations (version) VALUES (:version)"), {"version": version})
+        print(f"Применена миграция {version}: {description}")
+        applied.append(version)
+    return applied
+
+
+if __name__ == "__main__":
+    asyncio.run(run_migrations())
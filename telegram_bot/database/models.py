@@ -1,6 +1,6 @@
 from sqlalchemy import (
     Column, Integer, ForeignKey, Enum, Text, String,
-    TIMESTAMP, func
+    TIMESTAMP, Index, func, text
 )
 from sqlalchemy.orm import relationship
 import enum
@@ -35,6 +35,7 @@ class Chat(Base):
     __tablename__ = "chats"
 
     id = Column(String, primary_key=True)
+    session_counter = Column(Integer, nullable=False, default=0, server_default="0")  # номер последней сессии чата
 
     sessions = relationship("SupportSession", back_populates="chat", cascade="all, delete-orphan")
 
@@ -50,11 +51,21 @@ class SupportSession(Base):
 
     created_at = Column(TIMESTAMP, server_default=func.now())
     edited_at = Column(TIMESTAMP, nullable=True)
-    closed_at = Column(TIMESTAMP, nullable=True)
+    closed_at = Column(TIMESTAMP, nullable=True)  # UTC
+    archived_at = Column(TIMESTAMP, nullable=True)  # сообщения перенесены в messages_archive
+    history_summary = Column(Text, nullable=True)  # краткое содержание ранних сообщений сессии
+    history_summarized_count = Column(Integer, nullable=False, default=0, server_default="0")  # сообщений в нем
 
     chat = relationship("Chat", back_populates="sessions")
     messages = relationship("Message", back_populates="session", cascade="all, delete-orphan")
 
+    __table_args__ = (
+        # поиск активной сессии чата
+        Index("ix_support_session_chat_status_created", "chat_id", "status", "created_at"),
+        # поиск завершенных сессий для архивации
+        Index("ix_support_session_status_closed", "status", "closed_at"),
+    )
+
 
 class Message(Base):
     __tablename__ = "messages"
@@ -63,9 +74,54 @@ class Message(Base):
     support_session_id = Column(String, ForeignKey("support_session.id"), nullable=False)
 
     content = Column(Text, nullable=False)
-    created_at_str = Column(String, nullable=True)
+    created_at = Column(TIMESTAMP, nullable=False, server_default=text("(now() at time zone 'utc')"))  # UTC
+    created_at_str = Column(String, nullable=True)  # устаревшее, оставлено для совместимости
     type = Column(Enum(MessageType, native_enum=False), nullable=False)
     role = Column(Enum(MessageRole, native_enum=False), nullable=False)
     assistant_type = Column(Enum(AssistantType, native_enum=False), nullable=True)
 
     session = relationship("SupportSession", back_populates="messages")
+
+    __table_args__ = (
+        # чтение истории сессии в порядке времени и постраничное чтение последних сообщений
+        Index("ix_messages_session_created", "support_session_id", "created_at", "id"),
+    )
+
+
+class MessageArchive(Base):
+    """Сообщения давно завершенных сессий, перенесенные из messages"""
+    __tablename__ = "messages_archive"
+
+    id = Column(String, primary_key=True)
+    support_session_id = Column(String, ForeignKey("support_session.id"), nullable=False)
+
+    content = Column(Text, nullable=False)
+    created_at = Column(TIMESTAMP, nullable=False)  # UTC
+    created_at_str = Column(String, nullable=True)
+    type = Column(Enum(MessageType, native_enum=False), nullable=False)
+    role = Column(Enum(MessageRole, native_enum=False), nullable=False)
+    assistant_type = Column(Enum(AssistantType, native_enum=False), nullable=True)
+
+    __table_args__ = (
+        Index("ix_messages_archive_session_created", "support_session_id", "created_at", "id"),
+    )
+
+
+class ScheduledFollowup(Base):
+    __tablename__ = "scheduled_followups"
+
+    chat_id = Column(String, ForeignKey("chats.id"), primary_key=True)  # не больше одного напоминания на чат
+    support_session_id = Column(String, ForeignKey("support_session.id"), nullable=False)
+    business_connection_id = Column(String, nullable=True)
+    due_at = Column(TIMESTAMP, nullable=False, index=True)  # UTC
+    # реплика, отправляющая напоминание, и до какого времени базы (UTC); истекшее напоминание забирается снова
+    claimed_by = Column(String, nullable=True)
+    claimed_until = Column(TIMESTAMP, nullable=True)
+
+
+class ChatLease(Base):
+    __tablename__ = "chat_leases"
+
+    chat_id = Column(String, primary_key=True)
+    owner = Column(String, nullable=False)  # идентификатор реплики бота, последней обрабатывавшей чат
+    expires_at = Column(TIMESTAMP, nullable=False)  # UTC, время базы
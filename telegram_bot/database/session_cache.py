@@ -0,0 +1,107 @@
+import os
+import time
+import uuid
+import logging
+from collections import OrderedDict
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+from telegram_bot.database.models import SupportSession, SupportStatus
+
+logger = logging.getLogger(__name__)
+
+# канал Postgres для сброса кеша в других репликах бота
+INVALIDATION_CHANNEL = "active_session_invalidate"
+
+
+class ActiveSessionCache:
+    """Ограниченный LRU-кеш активной сессии поддержки по чату.
+
+    Заполняется при чтении и обновляется crud при создании и изменении сессий.
+    Записи устаревают через ttl секунд на случай изменений, сделанных в обход процесса.
+    Изменения, сделанные другими репликами, сбрасываются через invalidate, в том числе по уведомлениям Postgres.
+    """
+
+    def __init__(self, max_size: int = 10000, ttl: float = 300.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.process_id = uuid.uuid4().hex
+        self._sessions: OrderedDict[str, tuple[SupportSession, float]] = OrderedDict()
+        self._listener: AsyncConnection | None = None
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, chat_id: str) -> SupportSession | None:
+        """Активная сессия чата из кеша или None, если ее нужно прочитать из базы"""
+        entry = self._sessions.get(chat_id)
+        if entry is None or time.monotonic() - entry[1] > self.ttl:
+            self._sessions.pop(chat_id, None)
+            self.misses += 1
+            return None
+        self._sessions.move_to_end(chat_id)
+        self.hits += 1
+        return entry[0]
+
+    def put(self, support_session: SupportSession) -> None:
+        """Запомнить сессию, если она активна, иначе убрать сессию чата из кеша"""
+        if support_session.status != SupportStatus.process:
+            self.invalidate(support_session.chat_id)
+            return
+        self._sessions[support_session.chat_id] = (support_session, time.monotonic())
+        self._sessions.move_to_end(support_session.chat_id)
+        while len(self._sessions) > self.max_size:
+            self._sessions.popitem(last=False)
+
+    def invalidate(self, chat_id: str | None = None) -> None:
+        """Сбросить сессию чата или весь кеш"""
+        if chat_id is None:
+            self._sessions.clear()
+        else:
+            self._sessions.pop(chat_id, None)
+
+    def notification(self, chat_id: str) -> str:
+        """Уведомление для других реплик об изменении сессии чата"""
+        return f"{self.process_id}:{chat_id}"
+
+    async def listen(self, engine: AsyncEngine | None) -> None:
+        """Сбрасывать записи по уведомлениям об изменениях сессий из других реплик.
+        engine должен подключаться к Postgres напрямую: через PgBouncer уведомления не доставляются"""
+        if self._listener is not None:
+            return
+        if engine is None:
+            logger.warning(
+                "Синхронизация кеша активных сессий отключена: нет прямого подключения к Postgres (DB_LISTEN_URL), "
+                "изменения из других реплик видны через %s с",
+                self.ttl
+            )
+            return
+        self._listener = await engine.connect()
+        raw_connection = await self._listener.get_raw_connection()
+        # после переподключения уведомления могли быть пропущены
+        self.invalidate()
+        await raw_connection.driver_connection.add_listener(INVALIDATION_CHANNEL, self._on_notification)
+
+    async def stop_listening(self) -> None:
+        if self._listener is not None:
+            await self._listener.close()
+            self._listener = None
+
+    def _on_notification(self, connection, pid, channel, payload: str) -> None:
+        process_id, _, chat_id = payload.partition(":")
+        if process_id != self.process_id:
+            self.invalidate(chat_id)
+
+
+async def notify_session_changed(connection, chat_id: str) -> None:
+    """Отправить другим репликам уведомление об изменении сессии чата в рамках текущей транзакции"""
+    await connection.execute(
+        text("SELECT pg_notify(:channel, :payload)"),
+        {"channel": INVALIDATION_CHANNEL, "payload": active_sessions.notification(chat_id)}
+    )
+
+
+active_sessions = ActiveSessionCache(
+    max_size=int(os.getenv("ACTIVE_SESSION_CACHE_SIZE", 10000)),
+    ttl=float(os.getenv("ACTIVE_SESSION_CACHE_TTL", 300))
+)
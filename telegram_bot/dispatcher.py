@@ -0,0 +1,131 @@
+import asyncio
+import logging
+from collections import deque
+from dataclasses import dataclass, field
+from typing import AsyncContextManager, Awaitable, Callable
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Job:
+    """Задача обработки сообщения чата"""
+    chat_id: str
+    func: Callable[[], Awaitable]
+    future: asyncio.Future = field(default_factory=lambda: asyncio.get_running_loop().create_future())
+
+
+class ChatWorkQueue:
+    """Очереди задач по чатам.
+
+    Задачи одного чата выполняются строго по порядку поступления, задачи разных чатов - параллельно
+    общим пулом воркеров с ограничением на число одновременно работающих задач.
+    При переполнении очереди submit ждет освобождения места.
+    Если задан chat_lock, задача выполняется под блокировкой чата, общей для нескольких процессов.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = 8,
+        max_pending: int = 1000,
+        metrics_interval: float = 60.0,
+        chat_lock: Callable[[str], AsyncContextManager] | None = None
+    ):
+        self.max_concurrency = max_concurrency
+        self.max_pending = max_pending
+        self.metrics_interval = metrics_interval
+        self.chat_lock = chat_lock
+        self._queues: dict[str, deque[Job]] = {}
+        self._ready: asyncio.Queue[str] = asyncio.Queue()
+        self._running: dict[str, Job] = {}
+        self._pending = 0
+        self._has_space = asyncio.Condition()
+        self._workers: list[asyncio.Task] = []
+        self._metrics_task: asyncio.Task | None = None
+
+    def start(self) -> None:
+        """Запустить воркеры"""
+        if self._workers:
+            return
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.max_concurrency)]
+        if self.metrics_interval:
+            self._metrics_task = asyncio.create_task(self._log_metrics())
+
+    async def stop(self) -> None:
+        """Дождаться выполнения поставленных задач и остановить воркеры"""
+        await self.join()
+        for task in [*self._workers, self._metrics_task]:
+            if task is not None:
+                task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._metrics_task = None
+
+    async def join(self) -> None:
+        """Дождаться выполнения всех поставленных задач"""
+        async with self._has_space:
+            await self._has_space.wait_for(lambda: self._pending == 0)
+
+    async def submit(self, chat_id: str, func: Callable[[], Awaitable]) -> asyncio.Future:
+        """Поставить задачу в очередь чата. Возвращает future с результатом задачи"""
+        async with self._has_space:
+            await self._has_space.wait_for(lambda: self._pending < self.max_pending)
+            self._pending += 1
+        job = Job(chat_id=chat_id, func=func)
+        queue = self._queues.get(chat_id)
+        if queue is None:
+            self._queues[chat_id] = deque([job])
+            self._ready.put_nowait(chat_id)
+        else:
+            queue.append(job)
+        return job.future
+
+    def metrics(self) -> dict[str, int]:
+        """Метрики очередей"""
+        return {
+            "pending": self._pending,
+            "running": len(self._running),
+            "chats": len(self._queues),
+            "max_chat_depth": max((len(queue) for queue in self._queues.values()), default=0),
+        }
+
+    async def _worker(self) -> None:
+        while True:
+            chat_id = await self._ready.get()
+            queue = self._queues[chat_id]
+            job = queue.popleft()
+            self._running[chat_id] = job
+            try:
+                result = await self._run_job(job)
+            except asyncio.CancelledError:
+                job.future.cancel()
+                raise
+            except Exception as e:
+                logger.exception("Ошибка обработки задачи чата %s", chat_id)
+                if not job.future.done():
+                    job.future.set_exception(e)
+                    # исключение уже залогировано, future может никто не ждать
+                    job.future.exception()
+            else:
+                if not job.future.done():
+                    job.future.set_result(result)
+            finally:
+                del self._running[chat_id]
+                if queue:
+                    self._ready.put_nowait(chat_id)
+                else:
+                    del self._queues[chat_id]
+                async with self._has_space:
+                    self._pending -= 1
+                    self._has_space.notify_all()
+
+    async def _run_job(self, job: Job):
+        if self.chat_lock is None:
+            return await job.func()
+        async with self.chat_lock(job.chat_id):
+            return await job.func()
+
+    async def _log_metrics(self) -> None:
+        while True:
+            await asyncio.sleep(self.metrics_interval)
+            logger.info("Очереди чатов: %s", self.metrics())
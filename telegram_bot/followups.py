@@ -0,0 +1,135 @@
+import uuid
+import heapq
+import asyncio
+import logging
+import datetime
+from typing import Awaitable, Callable
+
+from telegram_bot.database import crud
+from telegram_bot.database.models import ScheduledFollowup
+
+logger = logging.getLogger(__name__)
+
+
+class FollowupScheduler:
+    """Планировщик напоминаний клиентам.
+
+    Напоминания хранятся в базе и переживают перезапуск. В памяти держится только куча сроков
+    напоминаний, запланированных этим процессом, чтобы вовремя разбудить единственную корутину-обходчик.
+    Обходчик захватывает наступившие напоминания в базе на claim_ttl секунд, поэтому несколько реплик бота
+    не отправят одно напоминание одновременно, а напоминания, запланированные до перезапуска или другой
+    репликой, находятся не позже чем через poll_interval секунд. Напоминание удаляется из базы только после
+    отправки (crud.complete_followup), так что неотправленное из-за ошибки или остановки реплики
+    напоминание забирается снова, когда истечет захват.
+    """
+
+    def __init__(
+        self,
+        on_due: Callable[[ScheduledFollowup], Awaitable],
+        poll_interval: float = 30.0,
+        batch_size: int = 100,
+        claim_ttl: float = 300.0,
+        owner: str | None = None
+    ):
+        self.on_due = on_due
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self.claim_ttl = claim_ttl
+        self.owner = owner or uuid.uuid4().hex
+        self._heap: list[tuple[datetime.datetime, str]] = []
+        self._due: dict[str, datetime.datetime] = {}
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    def start(self) -> None:
+        """Запустить обходчик"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Остановить обходчик. Неотправленные напоминания остаются в базе и забираются снова после истечения захвата"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def schedule(
+        self,
+        chat_id: str,
+        support_session_id: str,
+        business_connection_id: str | None,
+        delay: float
+    ) -> None:
+        """Запланировать напоминание чату через delay секунд, заменив ранее запланированное"""
+        due_at = datetime.datetime.utcnow() + datetime.timedelta(seconds=delay)
+        await crud.schedule_followup(
+            chat_id=chat_id,
+            support_session_id=support_session_id,
+            business_connection_id=business_connection_id,
+            due_at=due_at
+        )
+        self._due[chat_id] = due_at
+        if not self._heap or due_at < self._heap[0][0]:
+            self._wakeup.set()
+        heapq.heappush(self._heap, (due_at, chat_id))
+        self._compact()
+
+    async def cancel(self, chat_id: str) -> None:
+        """Отменить напоминание чату"""
+        self._due.pop(chat_id, None)
+        await crud.cancel_followup(chat_id)
+
+    def metrics(self) -> dict[str, int]:
+        """Метрики планировщика"""
+        return {"scheduled": len(self._due), "heap": len(self._heap)}
+
+    def _compact(self) -> None:
+        # отмененные и перенесенные сроки удаляются из кучи лениво, при большом их числе куча пересобирается
+        if len(self._heap) > 2 * len(self._due) + 64:
+            self._heap = [(due_at, chat_id) for chat_id, due_at in self._due.items()]
+            heapq.heapify(self._heap)
+
+    def _next_delay(self, now: datetime.datetime) -> float:
+        while self._heap:
+            due_at, chat_id = self._heap[0]
+            if self._due.get(chat_id) != due_at:
+                heapq.heappop(self._heap)
+            else:
+                return min(max((due_at - now).total_seconds(), 0.0), self.poll_interval)
+        return self.poll_interval
+
+    async def _sweep(self, now: datetime.datetime) -> None:
+        while True:
+            followups = await crud.claim_due_followups(
+                now=now,
+                owner=self.owner,
+                ttl=self.claim_ttl,
+                limit=self.batch_size
+            )
+            for followup in followups:
+                if self._due.get(followup.chat_id) == followup.due_at:
+                    del self._due[followup.chat_id]
+                try:
+                    await self.on_due(followup)
+                except Exception:
+                    # захват истечет, и напоминание будет отправлено повторно
+                    logger.exception("Ошибка отправки напоминания чату %s", followup.chat_id)
+            if len(followups) < self.batch_size:
+                break
+        # наступившие сроки из кучи уже забраны этим процессом или другой репликой
+        while self._heap and self._heap[0][0] <= now:
+            due_at, chat_id = heapq.heappop(self._heap)
+            if self._due.get(chat_id) == due_at:
+                del self._due[chat_id]
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self._next_delay(datetime.datetime.utcnow()))
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self._sweep(datetime.datetime.utcnow())
+            except Exception:
+                logger.exception("Ошибка обхода напоминаний")
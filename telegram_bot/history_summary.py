@@ -0,0 +1,61 @@
+import asyncio
+import logging
+from functools import partial
+from typing import Awaitable, Callable
+
+from telegram_bot.session_history import SessionHistory
+
+logger = logging.getLogger(__name__)
+
+
+class HistorySummarizer:
+    """Инкрементальное краткое содержание истории сессии.
+
+    Последние keep_last сообщений остаются в истории дословно. Когда за их пределами накапливается
+    min_batch сообщений, они дописываются в краткое содержание одним вызовом модели, без пересказа
+    всей истории заново. Краткое содержание сохраняется в сессии поддержки.
+    """
+
+    def __init__(
+        self,
+        summarize: Callable[[str | None, str], Awaitable[str]],
+        save: Callable[..., Awaitable],
+        keep_last: int = 10,
+        min_batch: int = 4
+    ):
+        self.summarize = summarize
+        self.save = save
+        self.keep_last = keep_last
+        self.min_batch = min_batch
+        self._tasks: dict[str, asyncio.Task] = {}
+
+    def submit(self, session_history: SessionHistory) -> None:
+        """Запустить в фоне дополнение краткого содержания, если накопилось достаточно сообщений"""
+        end = len(session_history) - self.keep_last
+        if end - session_history.summarized_count < self.min_batch:
+            return
+        if session_history.support_session_id in self._tasks:
+            # незавершенное обновление догонится на следующем ходе
+            return
+        task = asyncio.create_task(self._update(session_history, end))
+        self._tasks[session_history.support_session_id] = task
+        task.add_done_callback(partial(self._forget_task, session_history.support_session_id))
+
+    async def stop(self) -> None:
+        """Дождаться незавершенных обновлений"""
+        await asyncio.gather(*list(self._tasks.values()), return_exceptions=True)
+
+    def _forget_task(self, support_session_id: str, task: asyncio.Task) -> None:
+        if self._tasks.get(support_session_id) is task:
+            del self._tasks[support_session_id]
+
+    async def _update(self, session_history: SessionHistory, end: int) -> None:
+        start = session_history.summarized_count
+        try:
+            summary = await self.summarize(session_history.summary, session_history.render_range(start, end))
+            await self.save(session_id=session_history.support_session_id, summary=summary, summarized_count=end)
+        except Exception:
+            logger.exception("Ошибка обновления краткого содержания сессии %s", session_history.support_session_id)
+            return
+        session_history.summary = summary
+        session_history.summarized_count = end
@@ -0,0 +1,136 @@
+import uuid
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable
+
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+from telegram_bot.database import crud
+
+logger = logging.getLogger(__name__)
+
+
+class ChatLeaseManager:
+    """Аренда чатов между репликами бота через таблицу chat_leases.
+
+    Пока задача чата выполняется, чат арендован этой репликой, остальные реплики ждут освобождения.
+    После listen ожидание прерывается уведомлением Postgres об освобождении чата, а повторный запрос
+    аренды без уведомления выполняется раз в max_wait_interval секунд; без listen - раз в retry_interval.
+    Аренда продлевается в фоне и истекает через ttl секунд, если реплика упала.
+    Если чат до этого обрабатывала другая реплика, вызывается on_takeover для сброса локальных кешей чата.
+    """
+
+    def __init__(
+        self,
+        owner: str | None = None,
+        ttl: float = 60.0,
+        retry_interval: float = 0.25,
+        max_wait_interval: float = 5.0,
+        before_release: Callable[[str], Awaitable] | None = None,
+        on_takeover: Callable[[str], None] | None = None
+    ):
+        self.owner = owner or uuid.uuid4().hex
+        self.ttl = ttl
+        self.retry_interval = retry_interval
+        self.max_wait_interval = max_wait_interval
+        self.before_release = before_release
+        self.on_takeover = on_takeover
+        self._waiters: dict[str, set[asyncio.Event]] = {}
+        self._listener: AsyncConnection | None = None
+        self.acquired = 0
+        self.waits = 0
+        self.takeovers = 0
+
+    @asynccontextmanager
+    async def hold(self, chat_id: str) -> AsyncIterator[None]:
+        """Арендовать чат на время выполнения блока"""
+        previous_owner = await self._acquire(chat_id)
+        if previous_owner is not None and previous_owner != self.owner:
+            self.takeovers += 1
+            if self.on_takeover is not None:
+                self.on_takeover(chat_id)
+        heartbeat = asyncio.create_task(self._heartbeat(chat_id))
+        try:
+            yield
+        finally:
+            heartbeat.cancel()
+            try:
+                # изменения чата должны попасть в базу до того, как его возьмет другая реплика
+                if self.before_release is not None:
+                    await self.before_release(chat_id)
+            finally:
+                await crud.release_chat_lease(chat_id=chat_id, owner=self.owner)
+                self._wake(chat_id)
+
+    async def listen(self, engine: AsyncEngine | None) -> None:
+        """Ждать освобождения чатов по уведомлениям Postgres вместо частых повторных запросов.
+        engine должен подключаться к Postgres напрямую: через PgBouncer уведомления не доставляются"""
+        if self._listener is not None:
+            return
+        if engine is None:
+            logger.warning(
+                "Уведомления об освобождении чатов отключены: нет прямого подключения к Postgres (DB_LISTEN_URL), "
+                "аренда запрашивается повторно раз в %s с",
+                self.retry_interval
+            )
+            return
+        self._listener = await engine.connect()
+        raw_connection = await self._listener.get_raw_connection()
+        await raw_connection.driver_connection.add_listener(crud.LEASE_RELEASE_CHANNEL, self._on_notification)
+
+    async def stop_listening(self) -> None:
+        if self._listener is not None:
+            await self._listener.close()
+            self._listener = None
+
+    def metrics(self) -> dict[str, int]:
+        """Метрики аренды"""
+        return {"acquired": self.acquired, "waits": self.waits, "takeovers": self.takeovers}
+
+    async def _acquire(self, chat_id: str) -> str | None:
+        # ожидание регистрируется до запроса аренды, чтобы не пропустить освобождение между ними
+        released = asyncio.Event()
+        self._waiters.setdefault(chat_id, set()).add(released)
+        try:
+            while True:
+                released.clear()
+                acquired, previous_owner = await crud.acquire_chat_lease(
+                    chat_id=chat_id,
+                    owner=self.owner,
+                    ttl=self.ttl
+                )
+                if acquired:
+                    self.acquired += 1
+                    return previous_owner
+                self.waits += 1
+                # без уведомлений аренда запрашивается часто, с ними - только на случай истечения аренды упавшей реплики
+                timeout = self.max_wait_interval if self._listener is not None else self.retry_interval
+                try:
+                    await asyncio.wait_for(released.wait(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            waiters = self._waiters[chat_id]
+            waiters.discard(released)
+            if not waiters:
+                del self._waiters[chat_id]
+
+    def _wake(self, chat_id: str) -> None:
+        for released in self._waiters.get(chat_id, ()):
+            released.set()
+
+    def _on_notification(self, connection, pid, channel, payload: str) -> None:
+        self._wake(payload)
+
+    async def _heartbeat(self, chat_id: str) -> None:
+        while True:
+            await asyncio.sleep(self.ttl / 3)
+            try:
+                renewed = await crud.renew_chat_lease(chat_id=chat_id, owner=self.owner, ttl=self.ttl)
+            except Exception:
+                logger.exception("Ошибка продления аренды чата %s", chat_id)
+                continue
+            if not renewed:
+                logger.error("Аренда чата %s потеряна", chat_id)
+                return
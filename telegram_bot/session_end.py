@@ -0,0 +1,100 @@
+import asyncio
+import logging
+from functools import partial
+from collections import OrderedDict
+from typing import Awaitable, Callable
+
+from telegram_bot.database.models import AssistantType, Message, MessageRole, SupportSession
+from telegram_bot.session_history import SessionHistory
+
+logger = logging.getLogger(__name__)
+
+
+def is_closing_candidate(message: Message) -> bool:
+    """Сообщения, по которым ищутся признаки завершения: клиента и специалиста. Ответы бота сами содержат
+    вежливые формулы завершения и в проверку не входят"""
+    if message.role == MessageRole.user:
+        return True
+    return message.role == MessageRole.assistant and message.assistant_type == AssistantType.human
+
+
+class SessionEndChecker:
+    """Фоновая проверка окончания сессии поддержки.
+
+    Проверка моделью запускается после отправки ответа и только если в новых сообщениях есть признаки
+    завершения диалога или с прошлой проверки накопилось max_unchecked сообщений.
+    Модель получает только последние window сообщений. Новая проверка сессии отменяет незавершенную,
+    вердикт по истории, в которую успели прийти новые сообщения, не применяется.
+    """
+
+    def __init__(
+        self,
+        check: Callable[[str], Awaitable[bool]],
+        on_end: Callable[[SupportSession], Awaitable],
+        has_closing_signal: Callable[[str], bool],
+        window: int = 6,
+        max_unchecked: int = 10,
+        max_sessions: int = 10000
+    ):
+        self.check = check
+        self.on_end = on_end
+        self.has_closing_signal = has_closing_signal
+        self.window = window
+        self.max_unchecked = max_unchecked
+        self.max_sessions = max_sessions
+        self._checked: OrderedDict[str, int] = OrderedDict()
+        self._tasks: dict[str, asyncio.Task] = {}
+        self.checks = 0
+        self.skipped = 0
+
+    def submit(self, support_session: SupportSession, session_history: SessionHistory) -> None:
+        """Запустить проверку окончания сессии в фоне, если новые сообщения на это указывают"""
+        checked = self._checked.get(support_session.id, 0)
+        unchecked = session_history.messages_since(checked)
+        if len(unchecked) < self.max_unchecked and not any(
+            self.has_closing_signal(message.content) for message in unchecked if is_closing_candidate(message)
+        ):
+            self.skipped += 1
+            return
+        task = self._tasks.get(support_session.id)
+        if task is not None:
+            task.cancel()
+        task = asyncio.create_task(self._check(support_session, session_history))
+        self._tasks[support_session.id] = task
+        task.add_done_callback(partial(self._forget_task, support_session.id))
+
+    def cancel(self, support_session_id: str) -> None:
+        """Отменить незавершенную проверку сессии, например, при новом сообщении клиента"""
+        task = self._tasks.get(support_session_id)
+        if task is not None:
+            task.cancel()
+
+    async def stop(self) -> None:
+        """Отменить незавершенные проверки"""
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _forget_task(self, support_session_id: str, task: asyncio.Task) -> None:
+        if self._tasks.get(support_session_id) is task:
+            del self._tasks[support_session_id]
+
+    async def _check(self, support_session: SupportSession, session_history: SessionHistory) -> None:
+        checked = len(session_history)
+        self.checks += 1
+        try:
+            is_end = await self.check(session_history.render_recent(self.window))
+        except Exception:
+            logger.exception("Ошибка проверки окончания сессии %s", support_session.id)
+            return
+        self._checked[support_session.id] = checked
+        self._checked.move_to_end(support_session.id)
+        while len(self._checked) > self.max_sessions:
+            self._checked.popitem(last=False)
+        if len(session_history) != checked:
+            # пока шла проверка, в сессии появились новые сообщения: вердикт устарел
+            return
+        if is_end:
+            self._checked.pop(support_session.id, None)
+            await self.on_end(support_session)
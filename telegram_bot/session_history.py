@@ -0,0 +1,192 @@
+import datetime
+from collections import OrderedDict
+
+from telegram_bot.database import crud
+from telegram_bot.database.journal import MessageJournal, message_journal
+from telegram_bot.database.models import Message, MessageRole, MessageType, AssistantType
+
+
+def render_message(message: Message) -> str:
+    """Сообщение в формате истории чата. Системные сообщения в историю не входят"""
+    if message.role == MessageRole.user:
+        return f"<Пользователь>\n{message.content}\n</Пользователь>\n\n"
+    if message.role == MessageRole.assistant:
+        return f"<Ассистент>\n{message.content}\n</Ассистент>\n\n"
+    return ""
+
+
+class SessionHistory:
+    """Сообщения сессии поддержки, загруженные из базы один раз, с инкрементальным построением истории чата.
+
+    Позиции сообщений отсчитываются от начала сессии, включая offset ранних сообщений, которые не загружены,
+    потому что уже вошли в краткое содержание.
+    """
+
+    def __init__(
+        self,
+        support_session_id: str,
+        messages: list[Message],
+        summary: str | None = None,
+        summarized_count: int = 0,
+        offset: int = 0
+    ):
+        self.support_session_id = support_session_id
+        self.offset = offset
+        # краткое содержание первых summarized_count сообщений
+        self.summary = summary
+        self.summarized_count = summarized_count
+        self.messages: list[Message] = []
+        self._parts: list[str] = []
+        self._rendered_end = 0
+        self._rendered = ""
+        for message in messages:
+            self.append(message)
+
+    def append(self, message: Message) -> None:
+        """Добавить новое сообщение сессии"""
+        self.messages.append(message)
+        self._parts.append(render_message(message))
+
+    def render(self, end: int | None = None) -> str:
+        """История чата по первым end сообщениям, без не загруженных ранних. Последний построенный префикс
+        кешируется и дополняется только новыми сообщениями"""
+        end = len(self.messages) if end is None else self._local(end)
+        if end < self._rendered_end:
+            return "".join(self._parts[:end])
+        if end > self._rendered_end:
+            self._rendered += "".join(self._parts[self._rendered_end:end])
+            self._rendered_end = end
+        return self._rendered
+
+    def render_range(self, start: int, end: int) -> str:
+        """История чата по сообщениям с start по end"""
+        return "".join(self._parts[self._local(start):self._local(end)])
+
+    def render_bounded(self, end: int | None = None) -> str:
+        """История чата по первым end сообщениям: краткое содержание ранних сообщений и следующие за ними
+        сообщения дословно. Пока краткого содержания нет, история выводится полностью"""
+        end = len(self) if end is None else end
+        if not self.summary:
+            return self.render(end)
+        summary = f"<Краткое содержание предыдущих сообщений>\n{self.summary}\n</Краткое содержание предыдущих сообщений>\n\n"
+        return summary + self.render_range(min(self.summarized_count, end), end)
+
+    def render_recent(self, count: int) -> str:
+        """История чата по последним count сообщениям, попадающим в историю"""
+        parts = []
+        for part in reversed(self._parts):
+            if len(parts) == count:
+                break
+            if part:
+                parts.append(part)
+        return "".join(reversed(parts))
+
+    def messages_since(self, start: int) -> list[Message]:
+        """Загруженные сообщения начиная с позиции start"""
+        return self.messages[self._local(start):]
+
+    def unanswered_user_messages(self) -> list[Message]:
+        """Сообщения клиента после последнего ответа ассистента. Системные сообщения ответом не считаются"""
+        unanswered = []
+        for message in reversed(self.messages):
+            if message.role == MessageRole.assistant:
+                break
+            if message.role == MessageRole.user:
+                unanswered.append(message)
+        return list(reversed(unanswered))
+
+    def _local(self, index: int) -> int:
+        return max(index - self.offset, 0)
+
+    def __len__(self) -> int:
+        return self.offset + len(self.messages)
+
+
+class SessionHistoryCache:
+    """Ограниченный по размеру кеш историй активных сессий. Новые сообщения записываются в базу через журнал"""
+
+    def __init__(self, journal: MessageJournal, max_size: int = 1000):
+        self.journal = journal
+        self.max_size = max_size
+        self._histories: OrderedDict[str, SessionHistory] = OrderedDict()
+
+    async def get(self, support_session_id: str) -> SessionHistory:
+        """Получить историю сессии, при отсутствии в кеше - загрузить из базы"""
+        history = self._histories.get(support_session_id)
+        if history is None:
+            # незаписанные сообщения берутся до чтения из базы, чтобы не пропустить записанные во время чтения
+            pending = self.journal.pending(support_session_id)
+            summary, summarized_count = await crud.get_history_summary(session_id=support_session_id)
+            if summary:
+                # сообщения из краткого содержания не нужны для истории чата: загружаются только следующие за ними
+                total, messages = await crud.get_message_tail(
+                    support_session_id=support_session_id,
+                    skip=summarized_count
+                )
+                offset = total - len(messages)
+            else:
+                messages = await crud.get_all_messages(support_session_id=support_session_id)
+                offset = 0
+            saved_ids = {message.id for message in messages}
+            messages.extend(message for message in pending if message.id not in saved_ids)
+            history = SessionHistory(
+                support_session_id=support_session_id,
+                messages=messages,
+                summary=summary,
+                summarized_count=summarized_count,
+                offset=offset
+            )
+            self._histories[support_session_id] = history
+            while len(self._histories) > self.max_size:
+                self._histories.popitem(last=False)
+        self._histories.move_to_end(support_session_id)
+        return history
+
+    async def count_messages(self, support_session_id: str, role: MessageRole | None = None) -> int:
+        """Число сообщений сессии: записанные в базу считаются запросом, еще не записанные - по журналу"""
+        pending = [
+            message for message in self.journal.pending(support_session_id) if role is None or message.role == role
+        ]
+        saved = await crud.count_messages(
+            support_session_id=support_session_id,
+            role=role,
+            exclude_ids=[message.id for message in pending]
+        )
+        return saved + len(pending)
+
+    async def add_message(
+        self,
+        support_session_id: str,
+        content: str,
+        *,
+        role: MessageRole,
+        assistant_type: AssistantType | None = None,
+        type: MessageType = MessageType.text,
+        created_at: datetime.datetime | None = None
+    ) -> Message:
+        """Передать сообщение в журнал записи и добавить его в загруженную историю сессии"""
+        message = self.journal.add(
+            support_session_id=support_session_id,
+            content=content,
+            role=role,
+            assistant_type=assistant_type,
+            type=type,
+            created_at=created_at
+        )
+        history = self._histories.get(support_session_id)
+        if history is not None:
+            history.append(message)
+        return message
+
+    def invalidate(self, support_session_id: str) -> None:
+        """Удалить историю сессии из кеша"""
+        self._histories.pop(support_session_id, None)
+
+    def invalidate_chat(self, chat_id: str) -> None:
+        """Удалить из кеша истории всех сессий чата"""
+        prefix = f"{chat_id}_"
+        for support_session_id in [key for key in self._histories if key.startswith(prefix)]:
+            del self._histories[support_session_id]
+
+
+session_histories = SessionHistoryCache(journal=message_journal)
@@ -0,0 +1,112 @@
+import time
+import asyncio
+
+from aiogram import Bot, types
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+
+# ограничение Telegram на длину текста сообщения
+MAX_MESSAGE_LENGTH = 4096
+
+
+class MessageStreamer:
+    """Постепенная отправка ответа: сообщение-заглушка, которое редактируется по мере генерации текста"""
+
+    def __init__(
+        self,
+        bot: Bot,
+        chat_id: str,
+        business_connection_id: str | None = None,
+        placeholder: str = "…",
+        min_edit_interval: float = 1.5,
+        min_chars_delta: int = 30
+    ):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.business_connection_id = business_connection_id
+        self.placeholder = placeholder
+        self.min_edit_interval = min_edit_interval
+        self.min_chars_delta = min_chars_delta
+        self.message: types.Message | None = None
+        self._shown_text = ""
+        self._last_edit = 0.0
+
+    async def start(self) -> None:
+        """Отправить сообщение-заглушку, которое затем будет заменено ответом"""
+        self.message = await self.bot.send_message(
+            chat_id=self.chat_id,
+            text=self.placeholder,
+            business_connection_id=self.business_connection_id,
+            parse_mode=None
+        )
+        self._shown_text = ""
+        self._last_edit = time.monotonic()
+
+    async def update(self, text: str) -> None:
+        """Показать накопленный текст. Редактирования ограничиваются по частоте и приросту текста.
+        Текст может не продолжать предыдущий, если ответ начат заново"""
+        if self.message is None:
+            await self.start()
+        if time.monotonic() - self._last_edit < self.min_edit_interval:
+            return
+        # текст, не продолжающий показанный (ответ начат заново), заменяет его без ожидания прироста
+        if text.startswith(self._shown_text) and len(text) - len(self._shown_text) < self.min_chars_delta:
+            return
+        # промежуточный текст может содержать незакрытые HTML-теги, поэтому без разметки
+        await self._edit(text[:MAX_MESSAGE_LENGTH], parse_mode=None)
+
+    async def finish(self, text: str) -> None:
+        """Показать полный ответ с разметкой. Текст длиннее лимита Telegram досылается отдельными сообщениями"""
+        parts = [text[i:i + MAX_MESSAGE_LENGTH] for i in range(0, len(text), MAX_MESSAGE_LENGTH)] or [text]
+        if self.message is None:
+            self.message = await self.bot.send_message(
+                chat_id=self.chat_id,
+                text=parts[0],
+                business_connection_id=self.business_connection_id
+            )
+        else:
+            await self._edit(parts[0], final=True)
+        for part in parts[1:]:
+            await self.bot.send_message(
+                chat_id=self.chat_id,
+                text=part,
+                business_connection_id=self.business_connection_id
+            )
+
+    async def discard(self) -> None:
+        """Удалить отправленное сообщение, если ответ больше не нужен"""
+        if self.message is None:
+            return
+        try:
+            if self.business_connection_id:
+                await self.bot.delete_business_messages(
+                    business_connection_id=self.business_connection_id,
+                    message_ids=[self.message.message_id]
+                )
+            else:
+                await self.bot.delete_message(chat_id=self.chat_id, message_id=self.message.message_id)
+        except TelegramBadRequest:
+            pass
+        self.message = None
+
+    async def _edit(self, text: str, final: bool = False, **kwargs) -> None:
+        try:
+            await self.bot.edit_message_text(
+                text=text,
+                chat_id=self.chat_id,
+                message_id=self.message.message_id,
+                business_connection_id=self.business_connection_id,
+                **kwargs
+            )
+        except TelegramRetryAfter as e:
+            if not final:
+                # пропускаем промежуточное обновление, следующее покажет актуальный текст
+                self._last_edit = time.monotonic() + e.retry_after
+                return
+            await asyncio.sleep(e.retry_after)
+            await self._edit(text, final=final, **kwargs)
+            return
+        except TelegramBadRequest as e:
+            if "message is not modified" not in e.message:
+                raise
+        self._shown_text = text
+        self._last_edit = time.monotonic()
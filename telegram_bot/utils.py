@@ -1,9 +1,10 @@
 import asyncio
 from aiogram import types
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 
 from telegram_bot.database import crud, models
 from telegram_bot.database.models import Message, MessageRole, SupportStatus, AssistantType
+from telegram_bot.session_history import SessionHistory, render_message, session_histories
 
 # Медиа-типы и их описания
 MEDIA_TYPE_MAP = {
@@ -23,13 +24,7 @@ MEDIA_TYPE_MAP = {
 
 def create_chat(support_session_messages: list[Message]) -> str:
     """Сформировать историю сообщений по сообщениям сессии"""
-    chat = ""
-    for message in support_session_messages:
-        if message.role == MessageRole.user:
-            chat += f"<Пользователь>\n{message.content}\n</Пользователь>\n\n"
-        if message.role == MessageRole.assistant:
-            chat += f"<Ассистент>\n{message.content}\n</Ассистент>\n\n"
-    return chat
+    return "".join(render_message(message) for message in support_session_messages)
 
 
 def has_media_content(message: types.Message) -> bool:
@@ -84,34 +79,54 @@ def get_media_info(message: types.Message) -> tuple[models.MessageType, str]:
 
 async def get_or_create_support_session(chat_id: str) -> models.SupportSession:
     """Получает или создает активную сессию поддержки"""
-    chat = await crud.get_or_create_chat(str(chat_id)) # преобразуем chat_id в строку
-    support_session = await crud.get_active_session(chat.id)
+    chat_id = str(chat_id)  # преобразуем chat_id в строку
+    # активная сессия обычно есть в кеше, тогда чат заведомо существует
+    support_session = await crud.get_active_session(chat_id)
     if not support_session:
+        chat = await crud.get_or_create_chat(chat_id)
         support_session = await crud.create_support_session(chat_id=chat.id)
     return support_session
 
 
-async def get_chat_history(support_session_messages: list[Message]) -> str | None:
-    """Получает историю чата для сессии"""
-    if len(support_session_messages) == 1:
+async def get_chat_history(
+    session_history: SessionHistory,
+    pending_messages_count: int = 1,
+    bounded: bool = False
+) -> str | None:
+    """Получает историю чата для сессии без последних pending_messages_count сообщений пользователя,
+    на которые сейчас отвечает агент. С bounded ранние сообщения заменяются их кратким содержанием"""
+    support_session_messages = session_history.messages
+    end = len(support_session_messages)
+    user_messages = 0
+    while end > 0 and user_messages < pending_messages_count:
+        end -= 1
+        if support_session_messages[end].role == MessageRole.user:
+            user_messages += 1
+    # позиция в истории с учетом ранних сообщений, не загруженных из базы
+    end += session_history.offset
+    if end == 0:
         return None
-    return create_chat(support_session_messages[:-1])
+    return session_history.render_bounded(end) if bounded else session_history.render(end)
 
 
-async def should_send_auto_reply(session_id: str) -> bool:
+def message_timestamp(message: types.Message, received_at: datetime) -> datetime:
+    """Время сообщения Telegram в UTC, по которому сообщения чата упорядочиваются в базе.
+
+    Telegram передает время с точностью до секунды, доли секунды берутся из времени получения сообщения
+    в пределах этой секунды. Так порядок не зависит от того, какая реплика и когда получила аренду чата.
+    """
+    sent_at = message.date.astimezone(timezone.utc).replace(tzinfo=None)
+    return min(max(received_at, sent_at), sent_at + timedelta(seconds=1, microseconds=-1))
+
+
+async def should_send_auto_reply(session_id: str, session_history: SessionHistory) -> bool:
     """Решает, нужен ли сообщение-автоответчика"""
-    session_messages = await crud.get_all_messages(session_id)
-    if session_id.split("_")[1] == "1" and len(session_messages) == 1:
+    if session_id.split("_")[1] == "1" and await session_histories.count_messages(session_id) == 1:
         return True
-    last_message = session_messages[-1]
-    if last_message.created_at_str:
-        try:
-            last_date = datetime.fromisoformat(last_message.created_at_str)
-            if datetime.now() - last_date >= timedelta(days=14):
-                return True
-        except Exception as e:
-            print(f"Ошибка парсинга даты: {e}")
-            return True
-    else:
+    last_message = session_history.messages[-1]
+    if last_message.created_at is None:
+        return True
+    # время сообщений хранится в UTC
+    if datetime.utcnow() - last_message.created_at >= timedelta(days=14):
         return True
     return False